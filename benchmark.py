@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+
+# Бенчмарк и дифференциальная проверка поиска пути stage_03_harvesters.utils.dijkstra
+#   python benchmark.py --sizes 10 100 1000 5000 --output benchmark_report.json
+
+import argparse
+import json
+import math
+import random
+import statistics
+import timeit
+import tracemalloc
+
+import numpy as np
+
+from stage_03_harvesters.utils.dijkstra import Dijkstra
+
+FIELD_SIZE = 1200.0
+DRONE_PAYLOAD = 100
+
+
+class StandInPoint:
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+class StandInCargo:
+    def __init__(self, payload, max_payload):
+        self.payload = payload
+        self.max_payload = max_payload
+
+    @property
+    def fullness(self):
+        return float(self.payload) / self.max_payload
+
+    @property
+    def is_empty(self):
+        return self.payload == 0
+
+    @property
+    def free_space(self):
+        return self.max_payload - self.payload
+
+
+class StandIn:
+    # Заглушка объекта сцены: distance_to, cargo и is_alive (+ coord, как у GameObject)
+    def __init__(self, x, y, payload=0, max_payload=DRONE_PAYLOAD, alive=True, team=None):
+        self.coord = StandInPoint(x, y)
+        self.cargo = StandInCargo(payload, max_payload)
+        self.is_alive = alive
+        self.team = team
+
+    def distance_to(self, other):
+        return math.hypot(self.coord.x - other.coord.x, self.coord.y - other.coord.y)
+
+
+class StandInMotherShip(StandIn):
+    pass
+
+
+class StandInScene:
+    def __init__(self, size, seed=0):
+        rnd = random.Random(seed)
+        # ~10% точек - обломки мертвых дронов
+        debris = size // 10
+        self.asteroids = [StandIn(rnd.uniform(0, FIELD_SIZE), rnd.uniform(0, FIELD_SIZE),
+                                  payload=rnd.choice([0, 50, 100, 200, 300]), max_payload=300)
+                          for _ in range(max(size - debris - 1, 0))]
+        self.motherships = [StandInMotherShip(90, 90, max_payload=2000, team="home")]
+        self.drones = [StandIn(rnd.uniform(0, FIELD_SIZE), rnd.uniform(0, FIELD_SIZE),
+                               payload=rnd.choice([0, 50, 100]), alive=False, team="enemy")
+                       for _ in range(debris)]
+
+
+class StandInUnit(StandIn):
+    def __init__(self, scene):
+        super(StandInUnit, self).__init__(FIELD_SIZE / 3, FIELD_SIZE / 3, team="home")
+        self.id = 1
+        self.scene = scene
+        self.mothership = scene.motherships[0]
+        self._path_closest = None
+
+
+def path_cost(graph, path):
+    return sum(graph.edge_weight(a, b) for a, b in zip(path, path[1:]))
+
+
+def dense_weights(graph):
+    # Матрица V x V из весов графа (для разреженного - inf там, где нет ребра)
+    if graph.adjacency is None:
+        return graph.weights
+    size = len(graph.points)
+    dense = np.full((size, size), np.inf)
+    rows, slots = np.nonzero(graph.adjacency >= 0)
+    dense[rows, graph.adjacency[rows, slots]] = graph.weights[rows, slots]
+    np.fill_diagonal(dense, 0.0)
+    return dense
+
+
+def reference_costs(weights, fi):
+    # Эталон без отсечений - Беллман-Форд на numpy для плотной матрицы
+    cost = np.full(len(weights), np.inf)
+    cost[fi] = 0.0
+    for _ in range(len(weights)):
+        relaxed = np.min(cost[:, None] + weights, axis=0)
+        relaxed[fi] = 0.0
+        if np.array_equal(relaxed, cost):
+            break
+        cost = relaxed
+    return cost
+
+
+def harvest_weights(graph, a, b):
+    # Веса как в ReaperStrategy.weight_harvest_batch при _edge_weights = True (distance_limit - четверть диагонали поля)
+    fullness = graph.fullness[b]
+    weights = graph.distance(a, b) / (0.25 * math.hypot(FIELD_SIZE, FIELD_SIZE)) + (1.0 - fullness)
+    return np.where((fullness == 0.0) | graph.is_mothership[b], np.inf, weights)
+
+
+def unload_weights(graph, a, b):
+    # Веса как в ReaperStrategy.weight_unload_batch при _edge_weights = True
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weights = graph.home_distance(b) / graph.home_distance(a) * graph.distance(a, b) + \
+                  (1.0 - graph.fullness[b])
+    return np.where(graph.is_home[a] | graph.is_home[b], 0.0, weights)
+
+
+def production_graphs(unit, name, **kwargs):
+    # Графы сбора (от базы) и разгрузки (к базе) с фильтрами и весами как в ReaperStrategy
+    graph = Dijkstra(unit, **kwargs)
+    if name == "harvest":
+        graph.update_units(func=lambda u: not u.cargo.is_empty)
+        graph.calc_weights(batch_func=harvest_weights)
+    else:
+        graph.update_units(func=lambda u: u.cargo.fullness < 1.0)
+        graph.calc_weights(batch_func=unload_weights)
+    return graph
+
+
+def differential_check(size, seed=0, targets=None, knn_neighbors=4):
+    # Сравнивает движки на одинаковых входных данных в двух конфигурациях:
+    #  - как в игре (prune=True, фильтры и веса ReaperStrategy, запросы от базы на графе сбора
+    #    и к базе на графе разгрузки): пути heap - с исходным алгоритмом, остальные движки - с heap;
+    #  - без отсечения: стоимости путей - с эталоном Беллмана-Форда, пути дерева - с heap;
+    #    разреженный граф из k < V соседей - с эталоном на той же k-NN смежности.
+    # Возвращает (число расхождений по движкам, число пропущенных сравнений по причинам)
+    scene = StandInScene(size, seed)
+    unit = StandInUnit(scene)
+    mismatches = dict.fromkeys(["heap", "cached", "sparse", "heap_exact", "astar_exact",
+                                "tree_exact", "sparse_exact", "sparse_knn"], 0)
+    # Исходный алгоритм не цепляет отсеченную цель к пути (путь начинается не с from):
+    # heap в этом случае сравнивать не с чем
+    skipped = {"legacy_unattached": 0}
+
+    for name in ("harvest", "unload"):
+        legacy = production_graphs(unit, name, engine=Dijkstra.ENGINE_LEGACY)
+        heap = production_graphs(unit, name)
+        uncached = production_graphs(unit, name, cache_size=0)
+        sparse = production_graphs(unit, name, neighbors=size)
+        home = heap.points[0]
+        points = heap.points[1:] if targets is None else heap.points[1:targets + 1]
+        for point in points:
+            pt_from, pt_to = (home, point) if name == "harvest" else (point, home)
+            path = heap.find_path(pt_from, pt_to)
+            reference = legacy.find_path(pt_from, pt_to)
+            if reference[0] != legacy.index_of(pt_from):
+                skipped["legacy_unattached"] += 1
+            elif path != reference:
+                mismatches["heap"] += 1
+            # Повторный запрос берется из кэша
+            if heap.find_path(pt_from, pt_to) != uncached.find_path(pt_from, pt_to):
+                mismatches["cached"] += 1
+            if sparse.find_path(pt_from, pt_to) != path:
+                mismatches["sparse"] += 1
+
+    graphs = {
+        "heap_exact": Dijkstra(unit, prune=False),
+        "sparse_exact": Dijkstra(unit, prune=False, neighbors=size),
+    }
+    for graph in graphs.values():
+        graph.update_units(func=lambda u: not u.cargo.is_empty)
+        graph.calc_weights()
+    exact = graphs["heap_exact"]
+    points = exact.points
+    home = points[0]
+    tree = exact.shortest_path_tree(home)
+    expected = reference_costs(exact.weights, 0)
+    for pt_to in points[1:] if targets is None else points[1:targets + 1]:
+        fo = exact.index_of(pt_to)
+        path = exact.find_path(home, pt_to)
+        if tree.path_to(pt_to) != path:
+            mismatches["tree_exact"] += 1
+        exact_paths = {
+            "heap_exact": path,
+            "astar_exact": exact.find_path(home, pt_to, astar=True),
+            "sparse_exact": graphs["sparse_exact"].find_path(home, pt_to),
+        }
+        for engine, engine_path in exact_paths.items():
+            if not np.isclose(path_cost(exact, engine_path), expected[fo]):
+                mismatches[engine] += 1
+
+    # neighbors=size выше дает ту же полную смежность, что и плотный граф: здесь соседей меньше
+    knn = Dijkstra(unit, prune=False, neighbors=knn_neighbors)
+    knn.update_units(func=lambda u: not u.cargo.is_empty)
+    knn.calc_weights()
+    home = knn.points[0]
+    expected = reference_costs(dense_weights(knn), 0)
+    for pt_to in knn.points[1:] if targets is None else knn.points[1:targets + 1]:
+        # Недостижимую цель find_path цепляет к последней раскрытой вершине несуществующим
+        # ребром: стоимость такого пути, как и эталона, - inf
+        if not np.isclose(path_cost(knn, knn.find_path(home, pt_to)), expected[knn.index_of(pt_to)]):
+            mismatches["sparse_knn"] += 1
+    return mismatches, skipped
+
+
+def measure(func, repeat=5, number=1):
+    # Время - как в timeit: repeat замеров по number вызовов, min и медиана на вызов;
+    # пик памяти - отдельным прогоном, чтобы tracemalloc не замедлял замеры времени
+    runs = [t / number for t in timeit.repeat(func, repeat=repeat, number=number)]
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": min(runs), "seconds_median": statistics.median(runs), "repeat": repeat,
+            "peak_bytes": peak}
+
+
+def bench_graph(size, seed, queries, **kwargs):
+    scene = StandInScene(size, seed)
+    unit = StandInUnit(scene)
+    graph = Dijkstra(unit, **kwargs)
+    rnd = random.Random(seed)
+    result = {
+        "update_units": measure(lambda: graph.update_units(func=lambda u: not u.cargo.is_empty)),
+        "calc_weights": measure(graph.calc_weights),
+    }
+    points = graph.points
+    targets = [rnd.choice(points) for _ in range(queries)]
+    home = points[0]
+
+    def run_queries(**query):
+        graph.clear_cache()
+        for pt_to in targets:
+            graph.find_path(home, pt_to, **query)
+
+    def expanded(mode, **query):
+        # Раскрыто вершин за один проход запросов
+        before = graph.stats[mode][1]
+        run_queries(**query)
+        return graph.stats[mode][1] - before
+
+    result["find_path"] = measure(run_queries)
+    result["find_path"]["expanded"] = expanded("dijkstra")
+    result["find_path_cached"] = measure(lambda: [graph.find_path(home, pt_to) for pt_to in targets])
+    # На графах с отсечением heuristic_scale = 0 и find_path(astar=True) - тот же Dijkstra
+    if graph.heuristic_scale > 0:
+        result["find_path_astar"] = measure(lambda: run_queries(astar=True))
+        result["find_path_astar"]["expanded"] = expanded("astar", astar=True)
+    # Дерево путей строится только без отсечения
+    if not kwargs.get("prune", True):
+        result["shortest_path_tree"] = measure(lambda: graph.shortest_path_tree(home))
+    result["points"] = len(points)
+    return result
+
+
+def run(sizes, seed=0, queries=20, dense_limit=1000, reference_limit=100, neighbors=8):
+    report = {"seed": seed, "queries": queries, "sizes": {}}
+    for size in sizes:
+        engines = {"sparse": dict(neighbors=neighbors)}
+        if size <= dense_limit:
+            engines["dense"] = {}
+            engines["dense_exact"] = dict(prune=False)
+        if size <= reference_limit:
+            engines["legacy"] = dict(engine=Dijkstra.ENGINE_LEGACY)
+        entry = {name: bench_graph(size, seed, queries, **kwargs) for name, kwargs in engines.items()}
+        if size <= reference_limit:
+            mismatches, skipped = differential_check(size, seed)
+            entry["differential"] = {"mismatches": mismatches, "skipped": skipped}
+        report["sizes"][str(size)] = entry
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pathfinding benchmark for stage_03_harvesters")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--dense-limit", type=int, default=1000)
+    parser.add_argument("--reference-limit", type=int, default=100)
+    parser.add_argument("--neighbors", type=int, default=8)
+    parser.add_argument("--output", default="benchmark_report.json")
+    args = parser.parse_args()
+    report = run(args.sizes, seed=args.seed, queries=args.queries, dense_limit=args.dense_limit,
+                 reference_limit=args.reference_limit, neighbors=args.neighbors)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    differential = [entry["differential"] for entry in report["sizes"].values() if "differential" in entry]
+    mismatches = sum(sum(d["mismatches"].values()) for d in differential)
+    skipped = sum(sum(d["skipped"].values()) for d in differential)
+    print("Report written to {}, differential mismatches: {}, skipped: {}".format(args.output, mismatches, skipped))
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import heapq
 import math
 from random import shuffle
 
@@ -99,6 +100,93 @@ class KovalevDrone(Drone):
                 dr.need_stats = False
 
 
+class TeamSensors:
+    """
+    Общий для команды срез сцены: живые враги, их материнские корабли и точки с элериумом.
+    Собирается не чаще раза в такт, расстояния до дрона считаются по запросу и кешируются до следующего такта.
+    Выборка k ближайших - частичная, через heapq, без сортировки всего списка
+    """
+    _sensors = {}
+
+    @classmethod
+    def for_drone(cls, drone):
+        sensors = cls._sensors.get(drone.team)
+        if sensors is None or sensors.scene is not drone.scene:
+            sensors = cls(drone.scene, drone.team)
+            cls._sensors[drone.team] = sensors
+        sensors.refresh(drone)
+        return sensors
+
+    def __init__(self, scene, team):
+        self.scene = scene
+        self.team = team
+        self.tick = None
+        self.groups = {}
+        self._distances = {}
+        self._near = {}
+
+    def refresh(self, drone):
+        tick = getattr(self.scene, '_step', None)
+        if tick is not None and tick == self.tick:
+            return
+        self.tick = tick
+        self._distances.clear()
+        self._near.clear()
+        drones = self.scene.drones
+        motherships = self.scene.motherships
+        self.groups = {
+            'enemies': [enemy for enemy in drones if enemy.team != self.team and enemy.is_alive],
+            'enemy_motherships': [mothership for mothership in motherships
+                                  if mothership != drone.my_mothership and mothership.is_alive],
+            'asteroids': [asteroid for asteroid in drone.asteroids if asteroid.counter > 0],
+            'dead_enemies': [enemy for enemy in drones
+                             if enemy.team != self.team and not enemy.is_alive and enemy.cargo.payload > 0],
+            'dead_motherships': [mothership for mothership in motherships
+                                 if mothership != drone.my_mothership and not mothership.is_alive
+                                 and mothership.cargo.payload > 0],
+        }
+        self.groups['points'] = self.groups['asteroids'] + self.groups['dead_enemies'] \
+            + self.groups['dead_motherships']
+
+    def _ranked(self, drone, group):
+        key = (drone.id, group)
+        ranked = self._distances.get(key)
+        if ranked is None:
+            ranked = [(drone.distance_to(obj), number, obj) for number, obj in enumerate(self.groups[group])]
+            self._distances[key] = ranked
+        return ranked
+
+    def nearest(self, drone, group, k=None):
+        """
+        :param group: enemies, enemy_motherships, asteroids, dead_enemies, dead_motherships или points
+        :param k: сколько ближайших вернуть, None - все
+        :return: список [объект, расстояние до дрона] по возрастанию расстояния
+        """
+        ranked = self._ranked(drone, group)
+        if k is None or k >= len(ranked):
+            ranked = sorted(ranked)
+        else:
+            ranked = heapq.nsmallest(k, ranked)
+        return [[obj, distance] for distance, _, obj in ranked]
+
+    def nearest_enemy(self, drone):
+        ranked = self._ranked(drone, 'enemies')
+        return min(ranked)[2] if ranked else None
+
+    def points_near(self, drone, center, radius, k=None):
+        """
+        Точки с элериумом не дальше radius от center (материнского корабля), по возрастанию расстояния до дрона
+        """
+        key = (id(center), radius)
+        near = self._near.get(key)
+        if near is None:
+            near = {obj for obj in self.groups['points'] if obj.distance_to(center) < radius}
+            self._near[key] = near
+        ranked = [item for item in self._ranked(drone, 'points') if item[2] in near]
+        ranked = sorted(ranked) if k is None else heapq.nsmallest(k, ranked)
+        return [[obj, distance] for distance, _, obj in ranked]
+
+
 class Role:
 
     def __init__(self, drone):
@@ -114,29 +202,26 @@ class Role:
     def on_born(self):
         pass
 
-    def get_enemies(self):
-        self.enemies = [[enemy, self.drone.distance_to(enemy)] for enemy in self.drone.scene.drones
-                        if enemy.team != self.drone.team and enemy.is_alive and enemy not in self.enemies]
-        self.enemies.sort(key=lambda x: x[1])
+    @property
+    def sensors(self):
+        return TeamSensors.for_drone(self.drone)
+
+    def get_enemies(self, k=None):
+        self.enemies = self.sensors.nearest(self.drone, 'enemies', k)
 
     def get_enemies_motherships(self):
-        self.enemy_motherships = []
-        for mothership in self.drone.scene.motherships:
-            if mothership not in self.enemy_motherships \
-                    and mothership != self.drone.my_mothership \
-                    and mothership.is_alive:
-                self.enemy_motherships.append(mothership)
+        self.enemy_motherships = list(self.sensors.groups['enemy_motherships'])
 
     def get_nearest_enemy(self):
         self.get_enemies()
         if self.enemies:
             nearest_enemy = self.enemies[0][0]
-            for enemy, distance_to_enemy in self.enemies:
-                if len(self.enemies) == 1:
-                    if enemy.distance_to(enemy.my_mothership) > 200 or not enemy.my_mothership.is_alive:
-                        nearest_enemy = enemy
-                    else:
-                        nearest_enemy = enemy.my_mothership
+            if len(self.enemies) == 1:
+                enemy = nearest_enemy
+                if enemy.distance_to(enemy.my_mothership) > 200 or not enemy.my_mothership.is_alive:
+                    nearest_enemy = enemy
+                else:
+                    nearest_enemy = enemy.my_mothership
         else:
             nearest_enemy = None
         return nearest_enemy
@@ -197,50 +282,40 @@ class Role:
         position = Point(first_point.x + vec_position.x, first_point.y + vec_position.y)
         return position
 
-    def get_asteroids_with_elerium(self):
+    def get_asteroids_with_elerium(self, k=None):
         """
-        Метод формирует список астероидов с элериумом и сортирует его по расстоянию до дрона
+        Метод формирует список астероидов с элериумом, отсортированный по расстоянию до дрона
+        (k ближайших, если k задано)
         """
-        self.asteroids = [[asteroid, self.drone.distance_to(asteroid)] for asteroid in self.drone.asteroids
-                          if asteroid.counter > 0]
-        self.asteroids.sort(key=lambda x: x[1])
+        self.asteroids = self.sensors.nearest(self.drone, 'asteroids', k)
 
-    def get_dead_enemies_motherships(self):
+    def get_dead_enemies_motherships(self, k=None):
         """
-        Метод формирует список уничтоженных материнских кораблей противника и сортирует его по расстоянию до дрона
+        Метод формирует список уничтоженных материнских кораблей противника с элериумом, отсортированный
+        по расстоянию до дрона
         """
-        self.enemy_dead_motherships = [[mothership, self.drone.distance_to(mothership)]
-                                       for mothership in self.drone.scene.motherships
-                                       if mothership != self.drone.my_mothership and not mothership.is_alive
-                                       and mothership.cargo.payload > 0]
-        self.enemy_dead_motherships.sort(key=lambda x: x[1])
+        self.enemy_dead_motherships = self.sensors.nearest(self.drone, 'dead_motherships', k)
 
-    def get_dead_enemies(self):
+    def get_dead_enemies(self, k=None):
         """
-        Метод формирует список уничтоженных дронов противника и сортирует его по расстоянию до дрона
+        Метод формирует список уничтоженных дронов противника с элериумом, отсортированный по расстоянию до дрона
         """
-        self.dead_enemies = [[enemy, self.drone.distance_to(enemy)] for enemy in self.drone.scene.drones
-                             if enemy.team != self.drone.team and not enemy.is_alive and enemy.cargo.payload > 0]
-        self.dead_enemies.sort(key=lambda x: x[1])
+        self.dead_enemies = self.sensors.nearest(self.drone, 'dead_enemies', k)
 
-    def get_safe_points_to_harvest(self):
+    def get_safe_points_to_harvest(self, k=None):
         """
-        Метод формирует список безопасных точек для сбора ресурсов и сортирует его по расстоянию до дрона
+        Метод формирует список безопасных точек для сбора ресурсов (в пределах дальности выстрела от материнского
+        корабля), отсортированный по расстоянию до дрона
         """
-        self.safe_points_with_elerium = [[point[0], self.drone.distance_to(point[0])] for point in
-                                         self.overall_points_with_elerium
-                                         if point[0].distance_to(self.drone.my_mothership) < self.drone.attack_range]
-        self.safe_points_with_elerium.sort(key=lambda x: x[1])
+        self.safe_points_with_elerium = self.sensors.points_near(self.drone, self.drone.my_mothership,
+                                                                 self.drone.attack_range, k)
 
-    def get_overall_points_to_harvest(self):
+    def get_overall_points_to_harvest(self, k=None):
         """
-        Метод формирует список всех доступных точек для сбора ресурсов и сортирует его по расстоянию до дрона
+        Метод формирует список всех доступных точек для сбора ресурсов (астероиды, мертвые дроны и материнские
+        корабли противника), отсортированный по расстоянию до дрона
         """
-        self.get_dead_enemies()
-        self.get_dead_enemies_motherships()
-        self.get_asteroids_with_elerium()
-        self.overall_points_with_elerium = list(self.asteroids + self.dead_enemies + self.enemy_dead_motherships)
-        self.overall_points_with_elerium.sort(key=lambda x: x[1])
+        self.overall_points_with_elerium = self.sensors.nearest(self.drone, 'points', k)
 
     def change_the_role(self, role, drone):
         """
@@ -248,7 +323,6 @@ class Role:
         :param drone: дрон
         Метод изменяет роль дрона
         """
-        self.get_overall_points_to_harvest()
         self.drone.role = role(drone)
         self.drone.role.on_born()
 
@@ -285,7 +359,7 @@ class Harvester(Role):
     def on_unload_complete(self):
         self.drone.target = self.get_point()
         self._update_drones_targets()
-        self.get_safe_points_to_harvest()
+        self.get_safe_points_to_harvest(k=1)
         if self.safe_points_with_elerium:
             self.drone.move_at(self.safe_points_with_elerium[0][0])
         else:
@@ -315,7 +389,7 @@ class Harvester(Role):
         :return: obj; type of obj = astrobox.core.MotherShip or astrobox.core.Asteroid or astrobox.core.Drone
         """
         if not self.drone.cargo.is_full:
-            self.get_overall_points_to_harvest()
+            self.get_overall_points_to_harvest(k=1)
             nearest_point = self._get_nearest_point_to_harvest()
             if nearest_point == self.drone.my_mothership:
                 if self.enemies:
@@ -345,7 +419,7 @@ class Harvester(Role):
                 if len(self.enemies) > 10 and self.drone.my_mothership.payload < 500:
                     nearest_point = self.overall_points_with_elerium[0][0]
                 else:
-                    self.get_safe_points_to_harvest()
+                    self.get_safe_points_to_harvest(k=1)
                     if self.safe_points_with_elerium:
                         nearest_point = self.safe_points_with_elerium[0][0]
             elif not self.enemies and self.overall_points_with_elerium:
@@ -472,8 +546,7 @@ class Destructor(Role):
         self.get_enemies()
         self.get_enemies_motherships()
         if self.enemies:
-            self.get_overall_points_to_harvest()
-            self.get_safe_points_to_harvest()
+            self.get_safe_points_to_harvest(k=1)
             if self.safe_points_with_elerium:
                 self.change_the_role(Harvester, self.drone)
             allies_alive = [ally for ally in self.drone.my_team if ally.is_alive]
@@ -528,8 +601,7 @@ class Turret(Role):
             if self.drone.distance_to(nearest_enemy) < self.drone.attack_range + 100:
                 self.attack_the_target(nearest_enemy)
             else:
-                self.get_overall_points_to_harvest()
-                self.get_safe_points_to_harvest()
+                self.get_safe_points_to_harvest(k=1)
                 if self.safe_points_with_elerium:
                     self.change_the_role(Harvester, self.drone)
                 elif len(self.enemies) < len(allies_alive):
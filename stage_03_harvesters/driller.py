@@ -1,5 +1,4 @@
 from .reaper import ReaperStrategy, ReaperDrone
-from robogame_engine.theme import theme
 
 
 class DrillerStrategy(ReaperStrategy):
@@ -8,18 +7,17 @@ class DrillerStrategy(ReaperStrategy):
         for u in units:
             if u == self.unit.mothership:
                 continue
-            if u in self.data._targets.values():
+            if self.data._targets.is_reserved(u):
                 continue
-            if sum([theme.DRONE_CARGO_PAYLOAD for t in self.data._targets if
-                    self.data._targets[t] == u]) < u.cargo.payload:
+            if self.data._targets.reserved_cargo(u) < u.cargo.payload:
                 return u
 
     def get_harvest_target(self):
-        self.unit.pathfind.update_units(func=lambda u: not u.cargo.is_empty)
-        units = self.unit.pathfind.points
+        # Each teammate reserves at most one source, so the nearest len(drones) + 1
+        # sources always contain a free one if there is any
+        units = self.data.sources(self.unit).nearest(self.unit, len(self.data._drones) + 1)
         if not units:
             return None
-        units.sort(key=lambda u: u.distance_to(self.unit))
 
         u = self.distribute_harvest_sources(units)
         return u
@@ -1,26 +1,90 @@
 # -*- coding: utf-8 -*-
 
+import heapq
 import math
 from operator import mul
 
+import numpy as np
+
 from robogame_engine.geometry import Point
 from robogame_engine.theme import theme
 
 from .utils.dijkstra import Dijkstra
+from .utils.profiling import FsmProfile
+from .utils.reservations import TargetReservations
+from .utils.sources import SourceIndex
 from .utils.states import DroneStateIdle
 from .utils.strategies import Strategy, DroneUnitWithStrategies
+from .utils.world import WorldSnapshot
 
 
 class ReaperStrategy(Strategy):
     _distance_max = None
     _distance_limit = None
+    # Set to k to plan on a k-nearest-neighbour graph (stress maps with hundreds of sources)
+    _pathfind_neighbors = None
+    # Set to a file name to collect FSM statistics per team, written at match end
+    _fsm_profile = None
+    # The original weight builder never evaluated the weight functions (its map() was lazy),
+    # so the planner has always seen 0.0 on every edge. Set to True to plan on the real
+    # harvest/unload weights: that changes which targets drones pick and needs its own tuning
+    _edge_weights = False
 
     # Data contains information for team. It useful when
     # have more than one drone with that strategy
     class Data:
         def __init__(self):
-            self._targets = {}
+            self._targets = TargetReservations()
             self._drones = []
+            self._world = None
+            self._sources = None
+            self._graphs = {}
+            self._planned = {}
+            self.fat_source = None
+            # Planning passes (update_units + calc_weights) made by the team
+            self.plans = 0
+            # Ticks skipped by sleeping states of all team drones
+            self.skipped_ticks = 0
+            self.profile = None
+
+        # World snapshot is built once per game tick for the whole team
+        def world(self, unit):
+            self._world = WorldSnapshot.actual(self._world, unit.scene, unit.team)
+            return self._world
+
+        # Path-finding graphs are shared by the team: points and weights depend only
+        # on the mothership and the sources, never on the drone asking
+        def graph(self, name, unit, neighbors=None):
+            graph = self._graphs.get(name)
+            if graph is None:
+                graph = Dijkstra(unit, neighbors=neighbors)
+                self._graphs[name] = graph
+            return graph
+
+        # True for the first request of the graph in this tick: the caller then refreshes it for the whole team
+        def needs_plan(self, name, unit):
+            tick = self.world(unit).tick
+            if tick is not None and self._planned.get(name) == tick:
+                return False
+            self._planned[name] = tick
+            if unit.is_alive:
+                self._graphs[name].unit = unit
+            self.plans = self.plans + 1
+            return True
+
+        # Spatial index of non-empty sources, synced once per tick: new dead drones/motherships
+        # are added and refilled sources (drones unload onto asteroids) come back
+        def sources(self, unit):
+            world = self.world(unit)
+            if self._sources is None:
+                self._sources = SourceIndex(world.asteroids)
+            if self._sources.tick is None or self._sources.tick != world.tick:
+                self._sources.sync(world.dead_motherships)
+                # Dead drones drift, so they are kept out of the grid
+                self._sources.sync(world.dead_drones, movable=True)
+                self._sources.refresh()
+                self._sources.tick = world.tick
+            return self._sources
 
     _data = {}
 
@@ -32,6 +96,8 @@ class ReaperStrategy(Strategy):
 
     def __init__(self, *args, **kwargs):
         self._stepnum = 0
+        self.skipped_ticks = 0
+        self._states = {}
         super(ReaperStrategy, self).__init__(*args, **kwargs)
         if ReaperStrategy._distance_max is None:
             ReaperStrategy._distance_max = math.sqrt(
@@ -40,12 +106,14 @@ class ReaperStrategy(Strategy):
             ReaperStrategy._distance_limit = 0.25 * ReaperStrategy._distance_max
 
         self.data._drones.append(self.unit)
+        if self._fsm_profile and self.data.profile is None:
+            self.data.profile = FsmProfile.for_team(self.unit.team, self._fsm_profile)
 
-        # PathFinder
+        # PathFinder (team graphs, see Data.graph)
         if self.unit.pathfind is None:
-            self.unit.pathfind = Dijkstra(self.unit)
+            self.unit.pathfind = self.data.graph("harvest", self.unit, neighbors=self._pathfind_neighbors)
         if self.unit.pathfind_unload is None:
-            self.unit.pathfind_unload = Dijkstra(self.unit)
+            self.unit.pathfind_unload = self.data.graph("unload", self.unit, neighbors=self._pathfind_neighbors)
         self.data._enemy_drones = [d for d in self.unit.scene.drones if d.team != self.unit.team]
 
     def weight_harvest_func(self, a, b):
@@ -61,6 +129,17 @@ class ReaperStrategy(Strategy):
         values = [dist, 1.0 - b.cargo.fullness]
         return sum(map(mul, coef, values))
 
+    # Weights the planner had before the batch builder (see _edge_weights)
+    @staticmethod
+    def weight_zero_batch(graph, a, b):
+        return np.zeros(np.broadcast(a, b).shape)
+
+    # Пакетный аналог weight_harvest_func: a, b - массивы индексов точек graph
+    def weight_harvest_batch(self, graph, a, b):
+        fullness = graph.fullness[b]
+        weights = graph.distance(a, b) / self._distance_limit + (1.0 - fullness)
+        return np.where((fullness == 0.0) | graph.is_mothership[b], np.inf, weights)
+
     def get_harvest_source(self):
         center_of_scene = Point(theme.FIELD_WIDTH / 2, theme.FIELD_HEIGHT / 2)
         units = self.unit.pathfind.points
@@ -73,29 +152,47 @@ class ReaperStrategy(Strategy):
         for u in units:
             if u == self.unit.mothership:
                 continue
-            if sum([theme.DRONE_CARGO_PAYLOAD for t in self.data._targets if
-                    self.data._targets[t] == u]) < u.cargo.payload:
+            if self.data._targets.reserved_cargo(u) < u.cargo.payload:
                 return u
         return None
 
-    def get_harvest_target(self):
-        self.unit.pathfind.update_units(func=lambda u: not u.cargo.is_empty)
+    # Team planning pass for harvesting: once per tick, whichever drone asks first
+    def plan_harvest(self):
+        if self.data.needs_plan("harvest", self.unit):
+            self.unit.pathfind.update_units(func=lambda u: not u.cargo.is_empty,
+                                            sources=self.data.world(self.unit).sources)
+            self.unit.pathfind.calc_weights(func=self.weight_harvest_func,
+                                             batch_func=self.weight_harvest_batch if self._edge_weights
+                                             else self.weight_zero_batch)
+            self.data.fat_source = self.get_harvest_source()
+        return self.unit.pathfind
+
+    def plan_unload(self):
+        if self.data.needs_plan("unload", self.unit):
+            self.unit.pathfind_unload.update_units(func=lambda u: u.cargo.fullness < 1.0,
+                                                   sources=self.data.world(self.unit).sources)
+            self.unit.pathfind_unload.calc_weights(func=self.weight_unload_func,
+                                                    batch_func=self.weight_unload_batch if self._edge_weights
+                                                    else self.weight_zero_batch)
+        return self.unit.pathfind_unload
 
+    def get_harvest_target(self):
         didx = self.data._drones.index(self.unit)
+        pathfind = self.plan_harvest()
         if didx < 3:
-            center_of_scene = self.unit.mothership.coord.copy()
-            units = [p for p in self.unit.pathfind.points if p != self.unit.mothership]
+            # Points are planned once per tick; sources emptied since then are skipped
+            units = [p for p in pathfind.points if p != self.unit.mothership and not p.cargo.is_empty]
             if not units:
                 return None
-            units.sort(key=lambda u: u.distance_to(self.unit))
+            # Only the first didx + 1 are needed: partial sort, same order as sort()
+            units = heapq.nsmallest(didx + 1, units, key=self.unit.distance_to)
             return units[didx] if len(units) - 1 >= didx else units[0]
 
-        self.unit.pathfind.calc_weights(func=self.weight_harvest_func)
-        fat_source = self.get_harvest_source()
+        fat_source = self.data.fat_source
         if not fat_source:
             return None
 
-        path = self.unit.pathfind.find_path(self.unit.mothership, fat_source, as_objects=True)
+        path = pathfind.find_path(self.unit.mothership, fat_source, as_objects=True)
         if path is None:
             return None
 
@@ -118,19 +215,27 @@ class ReaperStrategy(Strategy):
         values = [dist, 1.0 - b.cargo.fullness]
         return sum(map(mul, coef, values))
 
+    # Пакетный аналог weight_unload_func
+    def weight_unload_batch(self, graph, a, b):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            weights = graph.home_distance(b) / graph.home_distance(a) * graph.distance(a, b) + \
+                      (1.0 - graph.fullness[b])
+        return np.where(graph.is_home[a] | graph.is_home[b], 0.0, weights)
+
     def get_unload_target(self):
         if self.data._drones.index(self.unit) < 2:
             return self.unit.mothership
-        if len([a for a in self.unit.scene.asteroids if a.cargo.payload > 0]) == 0:
+        world = self.data.world(self.unit)
+        if not world.asteroids_with_payload:
             return self.unit.mothership
 
-        self.unit.pathfind_unload.update_units(func=lambda u: u.cargo.fullness < 1.0)
+        pathfind = self.plan_unload()
+        # Drones starting from the same point share one cached solve
+        uclosest = pathfind.closest_to(self.unit)
+        self.unit._path_closest = uclosest
 
-        uclosest = self.unit.closest_in_path
-        self.unit.pathfind_unload.calc_weights(func=self.weight_unload_func)
-
-        path_unload = self.unit.pathfind_unload.find_path(uclosest, self.unit.mothership,
-                                                          as_objects=True)  # , info="unld")
+        path_unload = pathfind.find_path(uclosest, self.unit.mothership,
+                                         as_objects=True)  # , info="unld")
         if path_unload is None:
             return None
 
@@ -148,17 +253,46 @@ class ReaperStrategy(Strategy):
     def fsm_state(self):
         return self.unit.fsm_state
 
+    # FSM states are pooled per drone: one instance of every state class, reset on each entry
+    def make_state(self, state_class):
+        state = self._states.get(state_class)
+        if state is None:
+            state = state_class(self)
+            self._states[state_class] = state
+        else:
+            state.reset()
+        return state
+
     def game_step(self, *args, **kwargs):
         self._stepnum = self._stepnum + 1
         super(ReaperStrategy, self).game_step(*args, **kwargs)
 
-        newState = self.fsm_state.make_transition()
+        profile = self.data.profile
+        if profile is not None:
+            profile.tick(self.unit, self.fsm_state)
+
+        # Transition guards (cargo full, sources gone, enemies) are cheap and run every tick
+        if profile is None:
+            newState = self.fsm_state.make_transition()
+        else:
+            newState = profile.call(self.fsm_state, "make_transition")
+        if newState != self.fsm_state.__class__ or not self.unit.is_alive:
+            self.data._targets.release(self.unit)
         if newState != self.fsm_state.__class__:
-            self.data._targets[self.unit.id] = None
-            self.unit.set_fsm_state(newState(self))
+            if profile is not None:
+                profile.transition(self.fsm_state.__class__, newState)
+            self.unit.set_fsm_state(self.make_state(newState))
+        elif self.fsm_state.is_sleeping():
+            # Drone is in flight and nothing touched its target: no planning until arrival
+            self.skipped_ticks = self.skipped_ticks + 1
+            self.data.skipped_ticks = self.data.skipped_ticks + 1
+            return
 
         if self.unit.fsm_state:
-            self.unit.fsm_state.game_step()
+            if profile is None:
+                self.unit.fsm_state.game_step()
+            else:
+                profile.call(self.unit.fsm_state, "game_step")
 
 
 class ReaperDrone(DroneUnitWithStrategies):
@@ -187,5 +321,5 @@ class ReaperDrone(DroneUnitWithStrategies):
     def on_born(self):
         super(ReaperDrone, self).on_born()
         self._strategy = self._strategy_class(unit=self)
-        self.set_fsm_state(DroneStateIdle(self._strategy))
+        self.set_fsm_state(self._strategy.make_state(DroneStateIdle))
         self.append_strategy(self._strategy)
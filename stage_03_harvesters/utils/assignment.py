@@ -0,0 +1,55 @@
+import numpy as np
+
+
+def min_cost_assignment(cost):
+    # Венгерский алгоритм (с потенциалами) для прямоугольной матрицы стоимостей rows x cols.
+    # Возвращает список (row, col) минимальной суммарной стоимости; строк/столбцов, которым
+    # пары не хватило, в ответе нет. Недопустимые пары - np.inf
+    cost = np.asarray(cost, dtype=float)
+    if cost.ndim != 2 or cost.size == 0:
+        return []
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    rows, cols = cost.shape
+    finite = np.isfinite(cost)
+    big = (np.abs(cost[finite]).sum() + 1.0) * 2.0 if finite.any() else 1.0
+    cost = np.where(finite, cost, big)
+
+    u = np.zeros(rows + 1)
+    v = np.zeros(cols + 1)
+    match = np.zeros(cols + 1, dtype=int)
+    way = np.zeros(cols + 1, dtype=int)
+    for row in range(1, rows + 1):
+        match[0] = row
+        col0 = 0
+        minv = np.full(cols + 1, np.inf)
+        used = np.zeros(cols + 1, dtype=bool)
+        while True:
+            used[col0] = True
+            row0 = match[col0]
+            free = ~used[1:]
+            delta = cost[row0 - 1] - u[row0] - v[1:]
+            better = free & (delta < minv[1:])
+            minv[1:][better] = delta[better]
+            way[1:][better] = col0
+            candidates = np.where(free, minv[1:], np.inf)
+            col1 = int(np.argmin(candidates)) + 1
+            step = candidates[col1 - 1]
+            u[match[used]] += step
+            v[used] -= step
+            minv[1:][free] -= step
+            col0 = col1
+            if match[col0] == 0:
+                break
+        while col0:
+            col1 = way[col0]
+            match[col0] = match[col1]
+            col0 = col1
+
+    pairs = []
+    for col in range(1, cols + 1):
+        row = match[col]
+        if row and finite[row - 1, col - 1]:
+            pairs.append((col - 1, row - 1) if transposed else (row - 1, col - 1))
+    return sorted(pairs)
@@ -1,47 +1,238 @@
+import heapq
 import sys
+from collections import OrderedDict
+
+import numpy as np
+
+from .distances import DistanceTable, coords_of, pairwise_distances
+
+
+def backtrack(prev, fo):
+    path = []
+    root = fo  # back propagation
+    while prev[root] > -1:
+        path.append(root)
+        root = prev[root]
+    path.append(root)
+    path.reverse()
+    return path
+
+
+class PathTree:
+    # Дерево кратчайших путей из одной вершины: строится один раз, путь до любой точки - O(длины пути).
+    # Строится только без отсечения (prune=False): отсечение зависит от пары концов пути
+    def __init__(self, graph, root, cost, prev, last=None):
+        self._points = graph._points
+        self._index = graph._index
+        self._root = root
+        self._cost = cost
+        self._prev = prev
+        self._last = last
+
+    @property
+    def root(self):
+        return self._points[self._root]
+
+    def path_to(self, pt_to, as_objects=False):
+        fo = self._index.get(pt_to)
+        if fo is None:
+            return
+        if fo != self._root and self._prev[fo] < 0:
+            # Недостижимую цель find_path цепляет к последней раскрытой вершине
+            path = backtrack(self._prev, self._last) + [fo, ]
+        else:
+            path = backtrack(self._prev, fo)
+        if as_objects:
+            return [self._points[n] for n in path]
+        return path
 
 
 class Dijkstra:
-    def __init__(self, unit, points=None):
+    ENGINE_HEAP = "heap"
+    ENGINE_LEGACY = "legacy"
+
+    def __init__(self, unit, points=None, engine=ENGINE_HEAP, prune=True, neighbors=None, cache_size=128):
         self._unit = unit
-        self._points = points if points else []
-        self._weights = [[0.0 for _ in range(len(self._points))] for _ in range(len(self._points))]
+        self._engine = engine
+        # Отсечение соседей дороже среднего веса (и прямого ребра from->to), как в исходном алгоритме
+        self._prune = prune
+        # Разреженный режим для больших полей: у каждой точки только neighbors ближайших соседей
+        # и база. weights тогда имеет форму V x (neighbors + 1), номера соседей - в adjacency (-1 - нет ребра)
+        self._neighbors = neighbors
+        # Кэш путей (LRU): ключ - концы пути и версия графа, которая растет, только когда
+        # update_units или calc_weights действительно что-то меняют
+        self._version = 0
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._points = []
+        self._weights = np.zeros((0, 0))
+        self._adjacency = None
+        self._set_points(points if points else [])
+        # Число раскрытых вершин: в последнем запросе и суммарно по режимам поиска
+        self.last_expanded = 0
+        self.stats = {"dijkstra": [0, 0], "astar": [0, 0]}
 
     @staticmethod
     def maxint():
         return sys.maxsize
 
+    # Граф может принадлежать команде: при гибели владельца его передают живому дрону
+    @property
+    def unit(self):
+        return self._unit
+
+    @unit.setter
+    def unit(self, unit):
+        self._unit = unit
+
     @property
     def points(self):
-        return self._points
+        # Копия: сортировка снаружи не должна ломать индексы и матрицу весов
+        return list(self._points)
 
     @property
     def weights(self):
         return self._weights
 
+    @property
+    def adjacency(self):
+        return self._adjacency
+
+    # Массивы признаков точек для пакетных весовых функций: weight(graph, a, b), где a и b -
+    # совместимые по broadcast массивы индексов точек
+    @property
+    def xy(self):
+        return self._xy
+
+    @property
+    def payload(self):
+        return self._payload
+
+    @property
+    def fullness(self):
+        return self._fullness
+
+    @property
+    def is_mothership(self):
+        return self._is_mothership
+
+    @property
+    def is_home(self):
+        return self._is_home
+
+    def distance(self, a, b):
+        if self._adjacency is not None and self._xy is not None:
+            # Полную матрицу в разреженном режиме не собираем
+            delta = self._xy[a] - self._xy[b]
+            return np.hypot(delta[..., 0], delta[..., 1])
+        if self._distances is None:
+            self._distances = DistanceTable.for_scene(self._unit.scene).gather(self._points, self._xy)
+        return self._distances[a, b]
+
+    def home_distance(self, a):
+        return self.distance(a, 0)
+
+    def index_of(self, point):
+        return self._index.get(point)
+
     def _get_closest(self):
         if not self._unit.is_alive:
             return
+        return self.closest_to(self._unit)
+
+    def closest_to(self, unit):
+        if self._xy is not None:
+            delta = self._xy - (unit.coord.x, unit.coord.y)
+            return self._points[int(np.argmin(np.hypot(delta[:, 0], delta[:, 1])))]
         uclosest = self._points[0]
-        dclosest = self._points[0].distance_to(self._unit)
+        dclosest = self._points[0].distance_to(unit)
         for u in self._points:
-            chkdist = self._unit.distance_to(u)
+            chkdist = unit.distance_to(u)
             if chkdist < dclosest:
                 dclosest = chkdist
                 uclosest = u
         return uclosest
 
-    def update_units(self, func=None):
+    @property
+    def version(self):
+        return self._version
+
+    def clear_cache(self):
+        self._cache.clear()
+
+    @property
+    def cache_info(self):
+        return {"hits": self.cache_hits, "misses": self.cache_misses,
+                "size": len(self._cache), "version": self._version}
+
+    def _set_points(self, units):
+        size = len(units)
+        same = size == len(self._points) and all(p is q for p, q in zip(units, self._points))
+        if not same:
+            self._version += 1
+        adjacency = self._adjacency
+        mothership_class = self._unit.mothership.__class__ if size else None
+        self._points = units
+        self._index = {p: n for n, p in enumerate(units)}
+        self._distances = None
+        self._adjacency = None
+        self._xy = coords_of(units)
+        self._payload = np.array([p.cargo.payload for p in units], dtype=float)
+        self._fullness = np.array([p.cargo.fullness for p in units], dtype=float)
+        self._is_mothership = np.array([p.__class__ == mothership_class for p in units], dtype=bool)
+        self._is_home = np.array([p is self._unit.mothership for p in units], dtype=bool)
+        self._heuristic_scale = None
+        if self._neighbors is not None:
+            self._adjacency = self._nearest_neighbors(self._neighbors)
+            if not same or adjacency is None or not np.array_equal(adjacency, self._adjacency):
+                self._weights = np.zeros(self._adjacency.shape)
+                self._version += 1
+        elif not same:
+            self._weights = np.zeros((size, size))
+
+    def _nearest_neighbors(self, k, chunk=256):
+        size = len(self._points)
+        k = min(k, max(size - 1, 0))
+        adjacency = np.full((size, k + 1), -1, dtype=int)
+        for start in range(0, size, chunk):
+            rows = np.arange(start, min(start + chunk, size))
+            if self._xy is not None:
+                dist = pairwise_distances(self._xy[rows], self._xy)
+            else:
+                dist = np.array(self.distance(rows[:, None], np.arange(size)[None, :]), dtype=np.float32)
+            dist[np.arange(len(rows)), rows] = np.inf
+            if k:
+                nearest = np.argpartition(dist, k - 1, axis=1)[:, :k]
+                order = np.argsort(np.take_along_axis(dist, nearest, axis=1), axis=1, kind="stable")
+                adjacency[rows, :k] = np.take_along_axis(nearest, order, axis=1)
+        for home in np.flatnonzero(self._is_home).tolist():
+            linked = (adjacency[:, :k] == home).any(axis=1)
+            linked[home] = True
+            adjacency[~linked, k] = home
+        return adjacency
+
+    def edge_weight(self, a, b):
+        if self._adjacency is None:
+            return self._weights[a][b]
+        slots = np.flatnonzero(self._adjacency[a] == b)
+        return self._weights[a][slots[0]] if slots.size else np.inf
+
+    def update_units(self, func=None, sources=None):
         if func is None:
             func = lambda a: True
         units = [self._unit.mothership, ]
-        units = units + [a for a in self._unit.scene.asteroids if func(a)]
-        units = units + [m for m in self._unit.scene.motherships if
-                         not m.is_alive and m.team != self._unit.team and func(m)]
-        units = units + [d for d in self._unit.scene.drones if not d.is_alive and func(d)]
-        weights = [[0.0 for _ in range(len(units))] for _ in range(len(units))]
+        if sources is not None:
+            # Готовый список источников (WorldSnapshot.sources) - сцену не сканируем
+            units = units + [s for s in sources if func(s)]
+        else:
+            units = units + [a for a in self._unit.scene.asteroids if func(a)]
+            units = units + [m for m in self._unit.scene.motherships if
+                             not m.is_alive and m.team != self._unit.team and func(m)]
+            units = units + [d for d in self._unit.scene.drones if not d.is_alive and func(d)]
 
-        self._weights, self._points = weights, units
+        self._set_points(units)
         self._unit._path_closest = self._get_closest()
 
     def to_objects(self, indexes):
@@ -50,43 +241,187 @@ class Dijkstra:
     def weight_default_func(self, a, b):
         return float(a.distance_to(b))
 
-    def calc_weights(self, func=None):
+    @staticmethod
+    def weight_default_batch(graph, a, b):
+        return graph.distance(a, b)
+
+    def calc_weights(self, func=None, batch_func=None, trace=False):
         if not self._unit.is_alive:
             return
-        if func is None:
-            func = self.weight_default_func
-        dump = []
-        for f, a in enumerate(self._points):
-            def map_func(t, b):
-                if f == t:
-                    self._weights[f][t] = 0.0
-                else:
-                    d = float(func(a, b))
-                    self._weights[f][t] = d
+        if func is None and batch_func is None:
+            batch_func = self.weight_default_batch
+        size = len(self._points)
+        idx = np.arange(size)
+        targets = idx[None, :] if self._adjacency is None else np.maximum(self._adjacency, 0)
+        shape = (size, targets.shape[1])
+        if batch_func is not None:
+            weights = np.array(np.broadcast_to(batch_func(self, idx[:, None], targets), shape), dtype=float)
+        else:
+            # Произвольная пользовательская функция - считаем поэлементно
+            weights = np.zeros(shape)
+            for f, a in enumerate(self._points):
+                for slot, t in enumerate(np.broadcast_to(targets, shape)[f].tolist()):
+                    if f != t:
+                        weights[f, slot] = float(func(a, self._points[t]))
+        if self._adjacency is None:
+            np.fill_diagonal(weights, 0.0)
+        else:
+            weights[self._adjacency < 0] = np.inf
+        if weights.shape != self._weights.shape or not np.array_equal(weights, self._weights):
+            self._version += 1
+        self._weights = weights
+        self._heuristic_scale = None
+        if trace:
+            dump = []
+            for f in range(size):
+                dump.append("%s %s" % (
+                    self._unit.id, ",".join(["%8.2f" % d if d < float("inf") else "%8s"
+                                             for d in self._weights[f]])))
+            print("\n".join(dump))
 
-            map(map_func, *zip(*enumerate(self._points)))
-            dump.append("%s %s" % (
-                self._unit.id, ",".join(["%8.2f" % d if d < float("inf") else "%8s"
-                                         for d in self._weights[f]])))
-            dump.append("")
+    # Множитель для эвристики A*: h(v) = k * |v, to| допустима, пока каждое ребро не дешевле
+    # k * длины ребра. Для произвольной весовой функции k = min(w / dist); k <= 0 - только Dijkstra.
+    # Отсечение зависит от порядка раскрытия вершин, поэтому с prune A* дал бы другие пути: там k = 0.
+    # Графы ReaperStrategy строятся с prune и нулевыми весами, так что в игре A* не включается никогда
+    @property
+    def heuristic_scale(self):
+        if self._prune:
+            return 0.0
+        if self._heuristic_scale is None:
+            size = len(self._points)
+            idx = np.arange(size)
+            targets = idx[None, :] if self._adjacency is None else np.maximum(self._adjacency, 0)
+            dist = np.broadcast_to(self.distance(idx[:, None], targets), self._weights.shape)
+            edges = (dist > 0) & (self._weights < np.inf)
+            scale = float(np.min(self._weights[edges] / dist[edges])) if edges.any() else 0.0
+            self._heuristic_scale = scale if scale > 0 else 0.0
+        return self._heuristic_scale
 
-    def find_path(self, pt_from, pt_to, as_objects=False, info=None):
+    def find_path(self, pt_from, pt_to, as_objects=False, info=None, astar=False):
         if not self._unit.is_alive:
             return
-        if pt_from not in self._points or pt_to not in self._points:
+        fi = self._index.get(pt_from)
+        fo = self._index.get(pt_to)
+        if fi is None or fo is None:
             print(pt_from, pt_to, self._points)
-        fi = self._points.index(pt_from)
-        fo = self._points.index(pt_to)
+            return
         if info:
             info = [
                 "[{}:{}] {}->{} U:{} M:{}".format(
                     info, self._unit.id, fi, fo, self._unit, self._unit.mothership), ]
-        if fi == fo:
-            if as_objects:
-                return self.to_objects([fi, ])
+        key = (fi, fo, astar, self._version)
+        path = self._cache.get(key) if not info else None
+        if path is not None:
+            self.cache_hits += 1
+            self._cache.move_to_end(key)
+        else:
+            self.cache_misses += 1
+            if fi == fo:
+                path = [fi, ]
+            elif self._engine == self.ENGINE_LEGACY and self._adjacency is None:
+                path = self._find_path_legacy(fi, fo, info)
             else:
-                return [fi, ]
+                path = self._find_path_heap(fi, fo, info, astar)
+            path = tuple(path)
+            self._cache[key] = path
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        if as_objects:
+            return self.to_objects(path)
+        else:
+            return list(path)
 
+    def _dump_path(self, info, path):
+        info.append("        -----")
+        for _, t in enumerate(path):
+            info.append("        {}\t{}\t{}".format(
+                t, self._points[t], self._unit.mothership.distance_to(self._points[t])))
+        print("\n".join(info))
+
+    def _solve(self, fi, fo=-1, heuristic=None):
+        size = len(self._points)
+        if heuristic is None:
+            heuristic = np.zeros(size)
+        cost = np.full(size, np.inf)
+        prev = np.full(size, -1, dtype=int)
+        settled = np.zeros(size, dtype=bool)
+        cost[fi] = 0.0
+        frontier = [(0.0, fi)]
+        last = fi
+        expanded = 0
+        while frontier:
+            root_key, root = heapq.heappop(frontier)
+            if settled[root] or root_key > cost[root] + heuristic[root]:
+                continue
+            settled[root] = True
+            expanded += 1
+            if root == fo:
+                break
+            last = root
+
+            neighbors, nb_weights = self._open_edges(root, settled)
+            if not neighbors.size:
+                continue
+            if self._prune:
+                keep = nb_weights < nb_weights.mean()
+                if root == fi:
+                    keep &= neighbors != fo
+                neighbors, nb_weights = neighbors[keep], nb_weights[keep]
+            nb_cost = cost[root] + nb_weights
+            better = nb_cost < cost[neighbors]
+            neighbors, nb_cost = neighbors[better], nb_cost[better]
+            cost[neighbors] = nb_cost
+            prev[neighbors] = root
+            for nb, key in zip(neighbors.tolist(), (nb_cost + heuristic[neighbors]).tolist()):
+                heapq.heappush(frontier, (key, nb))
+        self.last_expanded = expanded
+        return cost, prev, settled, last
+
+    def _open_edges(self, root, settled):
+        row = self._weights[root]
+        if self._adjacency is None:
+            neighbors = np.flatnonzero(~settled & (row < np.inf))
+            return neighbors, row[neighbors]
+        neighbors = self._adjacency[root]
+        keep = row < np.inf
+        neighbors, row = neighbors[keep], row[keep]
+        keep = ~settled[neighbors]
+        return neighbors[keep], row[keep]
+
+    def shortest_path_tree(self, pt_from):
+        if not self._unit.is_alive:
+            return
+        fi = self._index.get(pt_from)
+        if fi is None:
+            return
+        # С отсечением дерево путей не совпало бы с find_path, здесь нужен find_path
+        if self._prune:
+            return
+        cost, prev, _, last = self._solve(fi)
+        return PathTree(self, fi, cost, prev.tolist(), last)
+
+    def _find_path_heap(self, fi, fo, info=None, astar=False):
+        size = len(self._points)
+        scale = self.heuristic_scale if astar else 0.0
+        mode = "astar" if scale > 0 else "dijkstra"
+        heuristic = scale * self.distance(np.arange(size), fo) if scale > 0 else None
+        cost, prev, settled, last = self._solve(fi, fo, heuristic)
+        self.stats[mode][0] += 1
+        self.stats[mode][1] += self.last_expanded
+        if not settled[fo]:
+            # Цель отсечена: как и раньше, цепляем её к последней достигнутой вершине
+            cost[fo] = cost[last] + self.edge_weight(last, fo)
+            prev[fo] = last
+        if info:
+            for k in range(size):
+                info.append("        {}\t{}\t{}".format(
+                    k, [prev[k], cost[k]], self._unit.mothership.distance_to(self._points[k])))
+        path = backtrack(prev.tolist(), fo)
+        if info:
+            self._dump_path(info, path)
+        return path
+
+    def _find_path_legacy(self, fi, fo, info=None):
         visited = []
         unvisited = [k for k, _ in enumerate(self._points)]
 
@@ -136,19 +471,7 @@ class Dijkstra:
             for k, t in enumerate(table):
                 info.append("        {}\t{}\t{}".format(
                     k, t, self._unit.mothership.distance_to(self._points[k])))
-        path = []
-        root = fo  # back propagation
-        while table[root][FPREV] > -1:
-            path.insert(0, root)
-            root = table[root][FPREV]
-        path.insert(0, root)
+        path = backtrack([t[FPREV] for t in table], fo)
         if info:
-            info.append("        -----")
-            for _, t in enumerate(path):
-                info.append("        {}\t{}\t{}".format(
-                    t, self._points[t], self._unit.mothership.distance_to(self._points[t])))
-            print("\n".join(info))
-        if as_objects:
-            return self.to_objects(path)
-        else:
-            return path
+            self._dump_path(info, path)
+        return path
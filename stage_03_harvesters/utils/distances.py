@@ -0,0 +1,72 @@
+import weakref
+
+import numpy as np
+
+
+def coords_of(objects):
+    coords = [getattr(o, "coord", None) for o in objects]
+    if None in coords:
+        return None
+    return np.array([[c.x, c.y] for c in coords], dtype=float).reshape(len(coords), 2)
+
+
+def pairwise_distances(xy_from, xy_to):
+    delta = xy_from[:, None, :] - xy_to[None, :, :]
+    return np.hypot(delta[..., 0], delta[..., 1]).astype(np.float32)
+
+
+class DistanceTable:
+    # Астероиды неподвижны весь матч: таблица расстояний между ними считается один раз на сцену,
+    # а строки движущихся/гибнущих объектов (базы, мертвые дроны) досчитываются при каждой выборке
+    _tables = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def for_scene(cls, scene):
+        table = cls._tables.get(scene)
+        if table is None:
+            table = cls(scene.asteroids)
+            cls._tables[scene] = table
+        return table
+
+    def __init__(self, objects):
+        self._objects = list(objects)
+        self._index = {o: n for n, o in enumerate(self._objects)}
+        self._table = None
+
+    @property
+    def table(self):
+        if self._table is None:
+            xy = coords_of(self._objects)
+            if xy is not None:
+                self._table = pairwise_distances(xy, xy)
+            else:
+                self._table = self._distances_to(self._objects, self._objects)
+        return self._table
+
+    def index_of(self, obj):
+        return self._index.get(obj, -1)
+
+    @staticmethod
+    def _distances_to(objects_from, objects_to):
+        distances = np.zeros((len(objects_from), len(objects_to)), dtype=np.float32)
+        for f, a in enumerate(objects_from):
+            for t, b in enumerate(objects_to):
+                distances[f, t] = a.distance_to(b)
+        return distances
+
+    def gather(self, points, xy=None):
+        size = len(points)
+        static = np.array([self.index_of(p) for p in points], dtype=int).reshape(size)
+        known = np.flatnonzero(static >= 0)
+        dynamic = np.flatnonzero(static < 0)
+        distances = np.empty((size, size), dtype=np.float32)
+        if known.size:
+            distances[np.ix_(known, known)] = self.table[np.ix_(static[known], static[known])]
+        if dynamic.size:
+            if xy is not None:
+                rows = pairwise_distances(xy[dynamic], xy)
+            else:
+                rows = self._distances_to([points[n] for n in dynamic], points)
+            distances[dynamic, :] = rows
+            distances[:, dynamic] = rows.T
+        return distances
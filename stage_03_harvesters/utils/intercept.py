@@ -0,0 +1,44 @@
+import numpy as np
+
+
+def velocities_of(objects, speed):
+    # Скорость по курсу (GameObject.direction в градусах) для движущихся объектов, 0 - для стоящих
+    directions = np.radians([o.direction for o in objects]).reshape(len(objects))
+    moving = np.array([bool(o.is_moving) for o in objects], dtype=bool).reshape(len(objects))
+    velocity = np.stack([np.cos(directions), np.sin(directions)], axis=-1) * speed
+    velocity[~moving] = 0.0
+    return velocity
+
+
+def intercept_points(pursuers_xy, targets_xy, targets_velocity, speed, stop_times=None):
+    # Самая ранняя точка перехвата для пар pursuer[i] -> target[i]: наименьший t >= 0, при котором
+    # |target + velocity * t - pursuer| = speed * t. stop_times - через сколько тактов цель
+    # остановится (долетит до своей точки), тогда перехват в точке остановки.
+    # Если догнать нельзя - текущая позиция цели. Возвращает (точки, время в тактах)
+    d = targets_xy - pursuers_xy
+    a = np.einsum("ij,ij->i", targets_velocity, targets_velocity) - speed * speed
+    b = 2.0 * np.einsum("ij,ij->i", d, targets_velocity)
+    c = np.einsum("ij,ij->i", d, d)
+    linear = np.isclose(a, 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # a == 0: скорости равны, b * t + c = 0
+        t_linear = np.where(b < 0, -c / b, np.inf)
+        disc = b * b - 4.0 * a * c
+        root = np.sqrt(np.maximum(disc, 0.0))
+        t1 = (-b - root) / (2.0 * a)
+        t2 = (-b + root) / (2.0 * a)
+    t1 = np.where(t1 >= 0, t1, np.inf)
+    t2 = np.where(t2 >= 0, t2, np.inf)
+    t_quad = np.where(disc >= 0, np.minimum(t1, t2), np.inf)
+    times = np.where(linear, t_linear, t_quad)
+    times[c == 0] = 0.0
+    if stop_times is not None:
+        stopped = times > stop_times
+        stop_xy = targets_xy + targets_velocity * np.where(np.isfinite(stop_times), stop_times, 0.0)[:, None]
+        delta = stop_xy - pursuers_xy
+        times = np.where(stopped, np.maximum(np.hypot(delta[:, 0], delta[:, 1]) / speed, stop_times), times)
+        targets_velocity = np.where(stopped[:, None], 0.0, targets_velocity)
+        targets_xy = np.where(stopped[:, None], stop_xy, targets_xy)
+    reachable = np.isfinite(times)
+    points = targets_xy + targets_velocity * np.where(reachable, times, 0.0)[:, None]
+    return points, times
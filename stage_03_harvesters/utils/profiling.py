@@ -0,0 +1,70 @@
+import atexit
+import json
+import time
+
+
+class FsmProfile:
+    # Статистика FSM дронов одной команды: такты и время в состояниях, переходы между состояниями,
+    # CPU make_transition/game_step по состояниям. Включается ReaperStrategy._fsm_profile,
+    # выгружается в файл при завершении матча (процесса)
+    _profiles = {}
+    _path = None
+
+    @classmethod
+    def for_team(cls, team, path):
+        profile = cls._profiles.get(team)
+        if profile is None:
+            profile = cls(team)
+            cls._profiles[team] = profile
+        if cls._path is None:
+            atexit.register(cls.export)
+        cls._path = path
+        return profile
+
+    @classmethod
+    def export(cls, path=None):
+        path = path or cls._path
+        if path is None or not cls._profiles:
+            return
+        with open(path, "w") as f:
+            json.dump({str(team): profile.as_dict() for team, profile in cls._profiles.items()}, f, indent=2)
+
+    def __init__(self, team):
+        self.team = team
+        self.ticks = {}
+        self.seconds = {}
+        self.transitions = {}
+        self.cpu = {}
+        self._entered = {}
+
+    def tick(self, unit, state):
+        # Время между тактами дрона относится к состоянию, в котором он был на прошлом такте
+        name = state.__class__.__name__
+        now = time.perf_counter()
+        entered = self._entered.get(unit.id)
+        if entered is not None:
+            self.seconds[entered[0]] = self.seconds.get(entered[0], 0.0) + now - entered[1]
+        self._entered[unit.id] = (name, now)
+        self.ticks[name] = self.ticks.get(name, 0) + 1
+
+    def transition(self, state_from, state_to):
+        key = (state_from.__name__, state_to.__name__)
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+
+    def call(self, state, method):
+        started = time.process_time()
+        result = getattr(state, method)()
+        elapsed = time.process_time() - started
+        entry = self.cpu.setdefault((state.__class__.__name__, method), [0, 0.0])
+        entry[0] += 1
+        entry[1] += elapsed
+        return result
+
+    def as_dict(self):
+        return {
+            "ticks": dict(self.ticks),
+            "seconds": dict(self.seconds),
+            "transitions": {"{} -> {}".format(*key): count for key, count in self.transitions.items()},
+            "cpu": {"{}.{}".format(*key): {"calls": calls, "seconds": seconds}
+                    for key, (calls, seconds) in self.cpu.items()},
+        }
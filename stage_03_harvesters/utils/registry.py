@@ -0,0 +1,120 @@
+import weakref
+
+from astrobox.core import Asteroid, Drone, MotherShip
+
+from .sources import SourceIndex
+from .world import scene_tick
+
+
+class HarvestableRegistry:
+    # Объекты матча, из которых можно добывать элериум (астероиды, мертвые дроны и базы), по типам.
+    # Обновляется не чаще раза в такт: появление/удаление объектов сцены, гибель, опустошение
+    # и пополнение груза. Готовые кортежи отдаются всем стратегиям без повторных обходов сцены
+    KINDS = (("asteroid", Asteroid), ("drone", Drone), ("mothership", MotherShip))
+    _registries = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def for_scene(cls, scene):
+        registry = cls._registries.get(scene)
+        if registry is None:
+            registry = cls(scene)
+            cls._registries[scene] = registry
+        registry.refresh()
+        return registry
+
+    def __init__(self, scene):
+        self._scene = scene
+        self._tick = None
+        self._units = {}
+        self._class_kinds = {}
+        # dict как упорядоченное множество
+        self._stocks = {kind: {} for kind, _ in self.KINDS}
+        self._harvestable = {kind: {} for kind, _ in self.KINDS}
+        self._views = {}
+        self._indexes = {}
+
+    def _kind_of(self, obj):
+        # Тип объекта определяется по классу один раз: снаряды и прочее просто пропускаются
+        cls = obj.__class__
+        if cls not in self._class_kinds:
+            self._class_kinds[cls] = None
+            for kind, kind_cls in self.KINDS:
+                if issubclass(cls, kind_cls):
+                    self._class_kinds[cls] = kind
+                    break
+        return self._class_kinds[cls]
+
+    def _sync_objects(self, objects):
+        # Разность множеств источников сцены: ловит и добавление с удалением в одном такте
+        current = {}
+        for obj in objects:
+            kind = self._kind_of(obj)
+            if kind is not None:
+                current[obj] = kind
+        for obj in [o for o in self._units if o not in current]:
+            kind = self._units.pop(obj)
+            self._set(self._stocks[kind], obj, False)
+            self._set(self._harvestable[kind], obj, False)
+            for index in self._indexes.values():
+                index.discard(obj)
+        for obj, kind in current.items():
+            if obj not in self._units:
+                self._units[obj] = kind
+
+    def _set(self, members, obj, value):
+        if value == (obj in members):
+            return False
+        if value:
+            members[obj] = True
+        else:
+            del members[obj]
+        self._views.clear()
+        return True
+
+    def refresh(self):
+        tick = scene_tick(self._scene)
+        if tick is not None and tick == self._tick:
+            return
+        self._tick = tick
+        self._sync_objects(self._scene.objects)
+        for obj, kind in self._units.items():
+            stock = kind == "asteroid" or not obj.is_alive
+            self._set(self._stocks[kind], obj, stock)
+            harvestable = stock and obj.cargo.payload > 0
+            if self._set(self._harvestable[kind], obj, harvestable) and harvestable:
+                for kinds, index in self._indexes.items():
+                    if kind in kinds:
+                        index.add(obj, kind == "drone")
+        # Индекс выбрасывает опустевшие источники при запросах: если груз вернулся в том же такте,
+        # реестр изменения не видит, поэтому индексы сами проверяют выброшенные источники
+        for index in self._indexes.values():
+            index.refresh()
+
+    def _view(self, name, members, kinds):
+        key = (name, kinds)
+        view = self._views.get(key)
+        if view is None:
+            kinds = kinds or tuple(kind for kind, _ in self.KINDS)
+            view = tuple(obj for kind in kinds for obj in members[kind])
+            self._views[key] = view
+        return view
+
+    # Все источники (в том числе пустые)
+    def stocks(self, *kinds):
+        return self._view("stocks", self._stocks, kinds)
+
+    # Источники с непустым грузом
+    def harvestable(self, *kinds):
+        return self._view("harvestable", self._harvestable, kinds)
+
+    # Пространственный индекс непустых источников указанных типов (SourceIndex)
+    def index(self, *kinds):
+        kinds = kinds or tuple(kind for kind, _ in self.KINDS)
+        index = self._indexes.get(kinds)
+        if index is None:
+            # Обломки дронов дрейфуют после гибели - вне сетки индекса
+            static = tuple(kind for kind in kinds if kind != "drone")
+            index = SourceIndex(self.harvestable(*static) if static else (),
+                                movable=self.harvestable("drone") if "drone" in kinds else ())
+            self._indexes[kinds] = index
+        return index
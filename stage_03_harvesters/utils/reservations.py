@@ -0,0 +1,52 @@
+class TargetReservations:
+    # Кто куда летит: прямой индекс (дрон -> цели) и обратный (цель -> дроны, зарезервированный груз),
+    # чтобы вопросы "кто летит к X" и "сколько груза уже забрали с X" решались за O(1).
+    # Дрон может держать несколько целей одного рейса (попутная остановка и основная цель)
+    def __init__(self):
+        self._targets = {}
+        self._holders = {}
+        self._cargo = {}
+
+    def __len__(self):
+        return len(self._targets)
+
+    # then - цель, к которой дрон полетит после target (с тем же cargo)
+    def reserve(self, drone, target, cargo=0, then=None):
+        self.release(drone)
+        if target is None:
+            return
+        targets = [target, ] if then is None else [target, then]
+        self._targets[drone.id] = (drone, targets, cargo)
+        for target in targets:
+            self._holders.setdefault(target, {})[drone.id] = drone
+            self._cargo[target] = self._cargo.get(target, 0) + cargo
+
+    def release(self, drone):
+        entry = self._targets.pop(drone.id, None)
+        if entry is None:
+            return
+        _, targets, cargo = entry
+        for target in targets:
+            holders = self._holders[target]
+            del holders[drone.id]
+            if holders:
+                self._cargo[target] -= cargo
+            else:
+                del self._holders[target]
+                del self._cargo[target]
+
+    def target_of(self, drone):
+        entry = self._targets.get(drone.id)
+        return entry[1][0] if entry else None
+
+    def holders(self, target):
+        return list(self._holders.get(target, {}).values())
+
+    def holders_count(self, target):
+        return len(self._holders.get(target, ()))
+
+    def is_reserved(self, target):
+        return target in self._holders
+
+    def reserved_cargo(self, target):
+        return self._cargo.get(target, 0)
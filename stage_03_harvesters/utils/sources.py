@@ -0,0 +1,176 @@
+import heapq
+import math
+
+
+class SourceIndex:
+    # Сетка источников элериума для выборки k ближайших без сортировки всего поля:
+    # поиск идет кольцами ячеек от дрона и останавливается, как только k-й найденный
+    # ближе следующего кольца. Опустевшие источники выбрасываются из сетки при встрече,
+    # refresh() возвращает их, когда груз снова появится (на астероиды разгружаются).
+    # Подвижные источники (обломки дронов дрейфуют после гибели) в сетку не попадают
+    # и просматриваются при каждом запросе
+    def __init__(self, sources=(), cell=100.0, movable=()):
+        self._cell = float(cell)
+        self._cells = {}
+        # источник -> подвижный ли он, для всех известных источников (в том числе пустых)
+        self._known = {}
+        self._members = set()
+        # dict как упорядоченное множество
+        self._loose = {}
+        self._bounds = None
+        self.tick = None
+        self.visited = 0
+        self.sync(sources)
+        self.sync(movable, movable=True)
+
+    def __len__(self):
+        return len(self._members)
+
+    def _key(self, x, y):
+        return int(x // self._cell), int(y // self._cell)
+
+    def sync(self, sources, movable=False):
+        for source in sources:
+            if source not in self._known:
+                self.add(source, movable)
+
+    # Возвращает в индекс известные источники, груз которых снова непустой
+    def refresh(self):
+        for source in self._known:
+            if source not in self._members and source.cargo.payload > 0:
+                self.add(source)
+
+    # Добавляет непустой источник независимо от sync(); movable=None - как был известен раньше
+    def add(self, source, movable=None):
+        if movable is None:
+            movable = self._known.get(source, False)
+        self._known[source] = movable
+        if source in self._members or source.cargo.payload <= 0:
+            return
+        self._members.add(source)
+        if movable:
+            self._loose[source] = True
+            return
+        key = self._key(source.coord.x, source.coord.y)
+        self._cells.setdefault(key, []).append(source)
+        if self._bounds is None:
+            self._bounds = [key[0], key[1], key[0], key[1]]
+        else:
+            bounds = self._bounds
+            bounds[0], bounds[1] = min(bounds[0], key[0]), min(bounds[1], key[1])
+            bounds[2], bounds[3] = max(bounds[2], key[0]), max(bounds[3], key[1])
+
+    def _drop(self, cell, source):
+        cell.remove(source)
+        self._members.discard(source)
+
+    # Забывает источник совсем (например, убранный со сцены)
+    def discard(self, source):
+        movable = self._known.pop(source, None)
+        if source not in self._members:
+            return
+        if movable:
+            del self._loose[source]
+            self._members.discard(source)
+        else:
+            self._drop(self._cells[self._key(source.coord.x, source.coord.y)], source)
+
+    def _loose_sources(self):
+        for source in list(self._loose):
+            if source.cargo.payload <= 0:
+                del self._loose[source]
+                self._members.discard(source)
+                continue
+            self.visited += 1
+            yield source
+
+    def _ring(self, cx, cy, ring):
+        if ring == 0:
+            yield cx, cy
+            return
+        for x in range(cx - ring, cx + ring + 1):
+            yield x, cy - ring
+            yield x, cy + ring
+        for y in range(cy - ring + 1, cy + ring):
+            yield cx - ring, y
+            yield cx + ring, y
+
+    # exclude - множество источников, которые пропускаются (например, занятые союзниками)
+    def nearest(self, unit, k=1, accept=None, exclude=None):
+        if k <= 0:
+            return []
+        found = []
+
+        def consider(source):
+            if exclude is not None and source in exclude:
+                return
+            if accept is not None and not accept(source):
+                return
+            entry = (-unit.distance_to(source), id(source), source)
+            if len(found) < k:
+                heapq.heappush(found, entry)
+            elif entry > found[0]:
+                heapq.heapreplace(found, entry)
+
+        for source in self._loose_sources():
+            consider(source)
+        if self._bounds is not None:
+            cx, cy = self._key(unit.coord.x, unit.coord.y)
+            bounds = self._bounds
+            last_ring = max(cx - bounds[0], cy - bounds[1], bounds[2] - cx, bounds[3] - cy)
+            ring = 0
+            while ring <= last_ring:
+                for key in self._ring(cx, cy, ring):
+                    cell = self._cells.get(key)
+                    if not cell:
+                        continue
+                    for source in list(cell):
+                        if source.cargo.payload <= 0:
+                            self._drop(cell, source)
+                            continue
+                        self.visited += 1
+                        consider(source)
+                # Все непросмотренные ячейки дальше ring * cell от дрона
+                if len(found) == k and -found[0][0] <= ring * self._cell:
+                    break
+                ring += 1
+        return [source for _, _, source in sorted(found, reverse=True)]
+
+    def corridor(self, start, end, width, accept=None):
+        # Источники не дальше width от отрезка start-end, по возрастанию крюка
+        # |start-s| + |s-end| - |start-end|; start/end - точки с x, y
+        dx, dy = end.x - start.x, end.y - start.y
+        length2 = dx * dx + dy * dy
+        direct = math.sqrt(length2)
+        found = []
+
+        def consider(source):
+            sx, sy = source.coord.x, source.coord.y
+            t = ((sx - start.x) * dx + (sy - start.y) * dy) / length2 if length2 else 0.0
+            t = min(1.0, max(0.0, t))
+            if math.hypot(sx - start.x - t * dx, sy - start.y - t * dy) > width:
+                return
+            if accept is not None and not accept(source):
+                return
+            detour = math.hypot(sx - start.x, sy - start.y) + math.hypot(end.x - sx, end.y - sy) - direct
+            found.append((detour, id(source), source))
+
+        for source in self._loose_sources():
+            consider(source)
+        if self._bounds is not None:
+            x0, y0 = self._key(min(start.x, end.x) - width, min(start.y, end.y) - width)
+            x1, y1 = self._key(max(start.x, end.x) + width, max(start.y, end.y) + width)
+            bounds = self._bounds
+            for x in range(max(x0, bounds[0]), min(x1, bounds[2]) + 1):
+                for y in range(max(y0, bounds[1]), min(y1, bounds[3]) + 1):
+                    cell = self._cells.get((x, y))
+                    if not cell:
+                        continue
+                    for source in list(cell):
+                        if source.cargo.payload <= 0:
+                            self._drop(cell, source)
+                            continue
+                        self.visited += 1
+                        consider(source)
+        found.sort()
+        return [(detour, source) for detour, _, source in found]
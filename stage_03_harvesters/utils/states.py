@@ -17,10 +17,23 @@ def get_point_on_way_to(unit, target, at_distance=None):
 
 
 class DroneState(object):
+    # Состояния переиспользуются (см. ReaperStrategy.make_state): без __dict__,
+    # а все поля сбрасываются в reset(). allocations - сколько объектов состояний создано
+    __slots__ = ("__strategy", "_ttl", "_wake_step", "_wake_cargo", "_wake_payload", "_wake_holders")
+    allocations = 0
+
     def __init__(self, strategy):
         assert (strategy is not None)
+        DroneState.allocations += 1
         self.__strategy = strategy
+        self.reset()
+
+    def reset(self):
         self._ttl = 0
+        self._wake_step = None
+        self._wake_cargo = None
+        self._wake_payload = None
+        self._wake_holders = 0
 
     @property
     def strategy(self):
@@ -40,23 +53,49 @@ class DroneState(object):
     def game_step(self):
         self._ttl = self._ttl + 1
 
+    # Сон на время перелета: до расчетного такта прибытия или до события с целью
+    # (изменился груз цели или число дронов, летящих к ней). Спит только game_step,
+    # make_transition проверяется каждый такт
+    def sleep_until_arrival(self, point, target=None):
+        ticks = int(self.unit.distance_to(point) / theme.DRONE_SPEED) - 1
+        if ticks <= 0:
+            return
+        targets = self.strategy.data._targets
+        self._wake_step = self.strategy._stepnum + ticks
+        self._wake_cargo = target.cargo if target is not None else None
+        self._wake_payload = self._wake_cargo.payload if self._wake_cargo is not None else None
+        self._wake_holders = targets.holders_count(targets.target_of(self.unit))
+
+    def is_sleeping(self):
+        if self._wake_step is None:
+            return False
+        targets = self.strategy.data._targets
+        if self.strategy._stepnum >= self._wake_step or not self.unit.is_alive or \
+                (self._wake_cargo is not None and self._wake_cargo.payload != self._wake_payload) or \
+                targets.holders_count(targets.target_of(self.unit)) != self._wake_holders:
+            self._wake_step = None
+            return False
+        self._ttl = self._ttl + 1
+        return True
+
+    @property
+    def world(self):
+        return self.strategy.data.world(self.unit)
+
     def sources(self):
-        _sources = self.scene.asteroids
-        _sources = _sources + [m for m in self.unit.scene.motherships
-                               if not m.is_alive and m.team != self.unit.team]
-        _sources = _sources + [d for d in self.unit.scene.drones if not d.is_alive]
-        has_sources = len([s for s in _sources if s.cargo.payload > 0]) > 0
-        return has_sources, _sources
+        world = self.world
+        return world.has_sources, world.sources
 
 
 class DroneStateNone(DroneState):
+    __slots__ = ()
+
     def make_transition(self):
         return self.__class__
 
 
 class DroneStateIdle(DroneState):
-    def __init__(self, strategy):
-        super(self.__class__, self).__init__(strategy)
+    __slots__ = ()
 
     def make_transition(self):
         if not self.unit.is_alive:
@@ -79,21 +118,24 @@ class DroneStateIdle(DroneState):
 
 
 class DroneStateUnload(DroneState):
-    def __init__(self, strategy):
+    __slots__ = ("_target", "_target_point", "_target_cargo", "_transition")
+
+    def reset(self):
+        super(DroneStateUnload, self).reset()
         self._target = None
+        self._target_point = None
         self._target_cargo = None
         self._transition = None
-        super(DroneStateUnload, self).__init__(strategy)
 
     def has_any_enemy_going_harvest(self):
         if not self._target_point:
             return False
-        enemy_drones = [d for d in self.unit.scene.drones if d.team != self.unit.team and d.is_alive and
-                        d.distance_to(self._target) < theme.CARGO_TRANSITION_DISTANCE * 4.0 and
-                        math.fabs(d.direction - Vector.from_points(
-                            d.coord, self._target.coord.copy()
-                        ).direction) < (math.pi / 180.0)]  # 1 degree
-        return len(enemy_drones) > 0
+        # Цели всех разгружающихся дронов команды проверяются за такт одним пакетом
+        targets = [self._target] + [d.fsm_state._target for d in self.strategy.data._drones
+                                    if d is not self.unit and isinstance(d.fsm_state, DroneStateUnload) and
+                                    d.fsm_state._transition]
+        return self.world.enemies_approaching(targets, theme.CARGO_TRANSITION_DISTANCE * 4.0,
+                                              math.pi / 180.0)[0]  # 1 degree
 
     def make_transition(self):
         # if self.unit.health < 0.6 and self.unit.distance_to(self.unit.mothership) > theme.MOTHERSHIP_HEALING_DISTANCE:
@@ -116,8 +158,9 @@ class DroneStateUnload(DroneState):
             self._target = target
             self._target_point = get_point_on_way_to(self.unit, target, theme.CARGO_TRANSITION_DISTANCE * 0.9)
             self._target_cargo = target.cargo
-            self.strategy.data._targets[self.unit.id] = self._target_point
+            self.strategy.data._targets.reserve(self.unit, self._target_point)
             self.unit.move_at(self._target_point)
+            self.sleep_until_arrival(self._target_point, target)
         if self._transition:
             self._transition.game_step()
             target = self.strategy.get_harvest_target()
@@ -129,25 +172,49 @@ class DroneStateUnload(DroneState):
 
 
 class DroneStateHarvest(DroneState):
-    def __init__(self, strategy):
-        super(DroneStateHarvest, self).__init__(strategy)
+    __slots__ = ("_target", "_target_cargo", "_transition", "_next_target")
+    # Попутный источник: не дальше pickup_corridor от пути к цели и крюк
+    # не больше pickup_cost на единицу догруженного элериума
+    pickup_corridor = 150.0
+    pickup_cost = 2.0
+
+    def reset(self):
+        super(DroneStateHarvest, self).reset()
+        self._target = None
+        self._target_cargo = None
+        self._transition = None
+        self._next_target = None
+
+    def pickup_stop(self, target):
+        # Остановка по пути имеет смысл, только если цель не заполнит трюм сама
+        space = self.unit.cargo.free_space - target.cargo.payload
+        if space <= 0:
+            return None
+        targets = self.strategy.data._targets
+        corridor = self.strategy.data.sources(self.unit).corridor(
+            self.unit.coord, target.coord, self.pickup_corridor,
+            accept=lambda s: s is not target and s is not self.unit.mothership and not targets.is_reserved(s))
+        for detour, source in corridor:
+            if detour <= self.pickup_cost * min(space, source.cargo.payload):
+                return source
+        return None
+
+    def next_leg(self):
+        # Догрузились на остановке - летим к основной цели (если ее успели опустошить - ищем новую)
+        target = self._next_target
+        self.strategy.data._targets.release(self.unit)
         self._target = None
         self._target_cargo = None
         self._transition = None
+        self._next_target = None
+        return target if target.cargo.payload > 0 else None
 
     def make_transition(self):
         if self.unit.cargo.is_full:
             return DroneStateUnload
-        if self._target:
-            hglob = [self.strategy.data._drones[t] for t in self.strategy.data._targets
-                     if self.strategy.data._targets[t] == self._target]
-            if len(hglob) > 1:
-                hglob.sort(key=lambda u: u.fullness)
-                reqsz = self._target_cargo.payload
-                for n, h in enumerate(hglob):
-                    reqsz = reqsz - self.unit.cargo.free_space
-                    if reqsz < 0:
-                        return DroneStateIdle
+        if self._next_target is not None and self._transition and self._transition.is_finished and \
+                not self.unit.cargo.is_full:
+            return self.__class__
         if self._target_cargo and self._target_cargo.fullness == 0.0:
             return DroneStateIdle
         if self._transition and self._transition.is_finished:
@@ -162,21 +229,35 @@ class DroneStateHarvest(DroneState):
 
     def game_step(self):
         super(DroneStateHarvest, self).game_step()
-        # TODO: harvest any possible targets on the way to self._target
+        target = None
+        if self._next_target is not None and self._transition and self._transition.is_finished:
+            target = self.next_leg()
         if self._transition:
             self._transition.game_step()
-            target = self.strategy.get_unload_target()
-            if target:
-                self.unit.turn_to(target)
+            if self._next_target is not None:
+                self.unit.turn_to(self._next_target)
             else:
-                self.unit.turn_to(self.unit.mothership)
+                heading = self.strategy.get_unload_target()
+                if heading:
+                    self.unit.turn_to(heading)
+                else:
+                    self.unit.turn_to(self.unit.mothership)
         if self._target is None:
-            target = self.strategy.get_harvest_target()
+            if target is None:
+                target = self.strategy.get_harvest_target()
+            if target is not None and self._next_target is None:
+                stop = self.pickup_stop(target)
+                if stop is not None:
+                    self._next_target = target
+                    target = stop
             if target is not None:
                 self._target = get_point_on_way_to(self.unit, target, theme.CARGO_TRANSITION_DISTANCE * 0.9)
                 self._target_cargo = target.cargo
                 self.unit.move_at(self._target.copy())
-                self.strategy.data._targets[self.unit.id] = target
+                # Основная цель попутного рейса тоже за нами, иначе ее разберут, пока мы на остановке
+                self.strategy.data._targets.reserve(self.unit, target, theme.DRONE_CARGO_PAYLOAD,
+                                                    then=self._next_target)
+                self.sleep_until_arrival(self._target, target)
             elif self._transition is not None:
                 return
         if self._transition is None and self._target and int(self.unit.distance_to(self._target)) <= 1:
@@ -186,8 +267,7 @@ class DroneStateHarvest(DroneState):
 
 
 class DroneStateAttack(DroneState):
-    def __init__(self, strategy):
-        super(DroneStateAttack, self).__init__(strategy)
+    __slots__ = ()
 
     def make_transition(self):
         # if self.unit.health < 0.6 and self.unit.distance_to(self.unit.mothership) > theme.MOTHERSHIP_HEALING_DISTANCE:
@@ -198,8 +278,10 @@ class DroneStateAttack(DroneState):
 
 
 class DroneStateRunout(DroneState):
-    def __init__(self, strategy):
-        super(DroneStateRunout, self).__init__(strategy)
+    __slots__ = ("_target", "_directions")
+
+    def reset(self):
+        super(DroneStateRunout, self).reset()
         self._target = None
         self._directions = [-25, 25]
         random.shuffle(self._directions)
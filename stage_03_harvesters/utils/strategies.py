@@ -1,19 +1,42 @@
 # -*- coding: utf-8 -*-
 
+import bisect
 import random
+import time
 
+import numpy as np
+
+from robogame_engine.geometry import Point
 from robogame_engine.theme import theme
 
 from astrobox.cargo import CargoTransition
-from astrobox.core import Drone, Unit, MotherShip
+from astrobox.core import Drone
+
+from .assignment import min_cost_assignment
+from .distances import coords_of
+from .intercept import intercept_points, velocities_of
+from .registry import HarvestableRegistry
+from .world import scene_tick
+
+
+# k ближайших к unit непустых источников (астероиды и мертвые дроны), кроме exclude
+def nearest_elerium_stocks(unit, k=1, exclude=None):
+    return HarvestableRegistry.for_scene(unit.scene).index("asteroid", "drone").nearest(unit, k, exclude=exclude)
 
 
 class Strategy(object):
-    def __init__(self, unit=None, id=None, group=None, is_group_unique=False):
+    def __init__(self, unit=None, id=None, group=None, is_group_unique=False, priority=0):
         self.__unit = unit
         self.__id = id
         self.__group = group
         self.__group_unique = is_group_unique
+        self.__priority = priority
+        self.__wake_tick = None
+        self.__wake_condition = None
+        self.__yields = True
+        # Счетчики хода узла: сколько раз вызван game_step и сколько ходов проспал
+        self.ticks = 0
+        self.skipped_ticks = 0
 
     @property
     def unit(self):
@@ -31,6 +54,62 @@ class Strategy(object):
     def is_group_unique(self):
         return self.__group_unique
 
+    # Чем выше приоритет, тем раньше стратегия получает ход (при равных - в порядке добавления)
+    @property
+    def priority(self):
+        return self.__priority
+
+    # Стратегия пропускает ходы до такта tick или пока condition() не станет истинным,
+    # уступая их следующим стратегиям дрона
+    def suspend(self, tick=None, condition=None):
+        self.__wake_tick = tick
+        self.__wake_condition = condition
+        self.__yields = True
+
+    # Узел продолжает работу (например, дрон летит), но до события его и все его
+    # поддерево тикать не нужно; ходы следующим стратегиям он не уступает
+    def sleep(self, tick=None, condition=None):
+        self.__wake_tick = tick
+        self.__wake_condition = condition
+        self.__yields = False
+
+    @property
+    def wake(self):
+        return self.__wake_tick, self.__wake_condition
+
+    @property
+    def yields(self):
+        return self.__yields
+
+    @property
+    def is_sleeping(self):
+        return not self.__yields and (self.__wake_tick is not None or self.__wake_condition is not None)
+
+    def is_suspended(self, tick=None):
+        if self.__wake_tick is None and self.__wake_condition is None:
+            return False
+        if (self.__wake_tick is not None and tick is not None and tick >= self.__wake_tick) or \
+                (self.__wake_condition is not None and self.__wake_condition()):
+            self.__wake_tick = None
+            self.__wake_condition = None
+            return False
+        return True
+
+    # Ход узла дерева стратегий: спящий узел не тикается вместе со своим поддеревом
+    def tick(self, tick=None):
+        if self.is_suspended(tick):
+            self.skipped_ticks += 1
+            return False
+        self.ticks += 1
+        self.game_step()
+        return True
+
+    # Ход дочернего узла: если тот уснул, родитель засыпает до того же события
+    def tick_child(self, child, tick=None):
+        child.tick(tick)
+        if child.is_sleeping:
+            self.sleep(*child.wake)
+
     def reset(self):
         pass
 
@@ -105,6 +184,17 @@ class StrategyApproach(Strategy):
         if new_distance > self._target_distance:
             self.__last_distance = new_distance
             self.unit.move_at(self._target_point.copy(), speed=theme.DRONE_SPEED)
+            # Раньше расчетного такта прибытия не долетим; будим раньше, если условие сближения
+            # перестало выполняться или дрон погиб
+            eta = int((new_distance - self._target_distance) / theme.DRONE_SPEED) - 1
+            tick = scene_tick(self.unit.scene)
+            if eta > 0 and tick is not None:
+                self.sleep(tick + eta, self._wake_condition)
+
+    def _wake_condition(self):
+        if not self.unit.is_alive:
+            return True
+        return self.__conditional_approach is not None and not self.__conditional_approach()
 
 
 # Комбинированные стратегии
@@ -140,7 +230,7 @@ class StrategySequence(Strategy):
         if self.__current_strategy.is_finished:
             if not self._next_strategy():
                 return
-        self.__current_strategy.game_step()
+        self.tick_child(self.__current_strategy, scene_tick(self.unit.scene))
 
 
 class StrategyApproachAndLoad(StrategySequence):
@@ -189,19 +279,14 @@ class StrategyHarvesting(Strategy):
             return self.__substrategy.id
         return ""
 
+    # Источники, которые уже разбирают союзники
+    def claimed_elerium_stocks(self):
+        return set(drone.elerium_stock for drone in self.unit.teammates if
+                   drone.elerium_stock is not None and not drone.cargo.is_full)
+
     def get_nearest_elerium_stock(self):
-        elerium_stocks = [asteriod for asteriod in self.unit.scene.asteroids if asteriod.cargo.payload > 0]
-        elerium_stocks += [drone for drone in self.unit.scene.drones if not drone.is_alive and drone.cargo.payload > 0]
-        for drone in self.unit.teammates:
-            if drone.elerium_stock is not None and \
-                    not drone.cargo.is_full and \
-                    drone.elerium_stock in elerium_stocks:
-                elerium_stocks.remove(drone.elerium_stock)
-
-        if not elerium_stocks:
-            return None
-        elerium_stocks = sorted(elerium_stocks, key=lambda x: x.distance_to(self.unit))
-        return elerium_stocks[0]
+        elerium_stocks = nearest_elerium_stocks(self.unit, exclude=self.claimed_elerium_stocks())
+        return elerium_stocks[0] if elerium_stocks else None
 
     def game_step(self):
         # Даем возможность переопределять выбор источника elerium'а
@@ -224,11 +309,15 @@ class StrategyHarvesting(Strategy):
                         # Делаем видимость загруженности дрона работой
                         self.__substrategy = StrategyApproach(unit=self.unit, target_point=self.anyAsteroid().coord)
         if self.__substrategy is not None:
-            self.__substrategy.game_step()
+            self.tick_child(self.__substrategy, scene_tick(self.unit.scene))
 
 
 class StrategyHunting(Strategy):
     _teams_strategies = {}
+    # Гистерезис: текущая жертва охотника считается ближе на столько, чтобы цели менялись редко
+    retarget_margin = 100.0
+    # Охотник меняет курс, только если прогноз точки перехвата сместился дальше, чем на столько
+    aim_tolerance = 20.0
 
     @classmethod
     def getTeamStrategy(cls, team, hunter):
@@ -241,29 +330,65 @@ class StrategyHunting(Strategy):
         super(StrategyHunting, self).__init__(**kwargs)
         self._hunters = []
         self._victims = []
+        self._assignment = {}
+        self._assigned_tick = None
+        self._intercepts = {}
+        self._aims = {}
+        # Команды move_at, отданные охотникам
+        self.commands = 0
+
+    def _assign(self, scene, team):
+        # Охотники команды и жертвы сопоставляются разом: минимум суммарного расстояния
+        hunters = [h for h in self._hunters if h.is_alive and not h.is_unloading]
+        # Дроны оппонентов с непустым карго дальше, чем дистанция до их mothership-а
+        self._victims = [drone for drone in scene.drones if
+                         drone.team != team and drone.is_alive and drone.cargo.payload > 0 and
+                         drone.distance_to(drone.mothership) > theme.MOTHERSHIP_SAFE_DISTANCE]
+        self._assignment = {}
+        if not hunters or not self._victims:
+            return
+        delta = coords_of(hunters)[:, None, :] - coords_of(self._victims)[None, :, :]
+        cost = np.hypot(delta[..., 0], delta[..., 1])
+        for h, hunter in enumerate(hunters):
+            if hunter.victim in self._victims:
+                cost[h, self._victims.index(hunter.victim)] -= self.retarget_margin
+        for h, v in min_cost_assignment(cost):
+            self._assignment[hunters[h]] = self._victims[v]
+        self._intercept(hunters)
+
+    def _intercept(self, hunters):
+        # Точки перехвата для всех охотников с целью - одним пакетом
+        self._intercepts = {}
+        pairs = [(h, self._assignment.get(h)) for h in hunters]
+        pairs = [(h, v) for h, v in pairs if v is not None and v.is_alive]
+        if not pairs:
+            return
+        victims = [v for _, v in pairs]
+        stops = []
+        for v in victims:
+            target_point = getattr(v.state, "target_point", None) if v.is_moving else None
+            stops.append(v.distance_to(target_point) / theme.DRONE_SPEED if target_point else np.inf)
+        points, _ = intercept_points(coords_of([h for h, _ in pairs]), coords_of(victims),
+                                     velocities_of(victims, theme.DRONE_SPEED), theme.DRONE_SPEED,
+                                     stop_times=np.array(stops, dtype=float))
+        for (hunter, _), (x, y) in zip(pairs, points.tolist()):
+            self._intercepts[hunter] = Point(x, y)
+
+    def aim(self, hunter, point):
+        self._aims[hunter] = point
+        self.commands += 1
+        hunter.move_at(point.copy(), speed=theme.DRONE_SPEED)
 
     def get_victim(self, hunter):
         if hunter not in self._hunters:
+            # Новый охотник - пересчитываем распределение с ним
             self._hunters.append(hunter)
-
-        if hunter.victim is not None \
-                and hunter.victim.distance_to(hunter.victim.mothership) > theme.MOTHERSHIP_SAFE_DISTANCE \
-                and hunter.victim.cargo.payload > 0:
-            return hunter.victim
-
-        # Все дроны оппонентов с непустым карго
-        enemies = [drone for drone in hunter.scene.drones if
-                   drone.team != hunter.team and drone.is_alive and drone.cargo.payload > 0]
-        # Дроны оппонетнов дальше, чем дистанция до их mothership-а
-        enemies = [enemy for enemy in enemies if enemy.distance_to(enemy.mothership) > theme.MOTHERSHIP_SAFE_DISTANCE]
-        for mate in self._hunters:
-            if hunter != mate and mate.victim is not None and mate.victim in enemies:
-                enemies.remove(mate.victim)
-        victim = None
-        for enemy in enemies:
-            if victim is None or hunter.distance_to(enemy) < hunter.distance_to(victim):
-                victim = enemy
-        return victim
+            self._assigned_tick = None
+        tick = scene_tick(hunter.scene)
+        if tick is None or tick != self._assigned_tick:
+            self._assigned_tick = tick
+            self._assign(hunter.scene, hunter.team)
+        return self._assignment.get(hunter)
 
     def game_step(self, hunter):
         if not hasattr(hunter, 'substrategy') or hunter.substrategy is None:
@@ -273,56 +398,39 @@ class StrategyHunting(Strategy):
                                           int(hunter.victim.distance_to(
                                               hunter.victim.mothership)) < theme.MOTHERSHIP_HEALING_DISTANCE):
             hunter._victim = None
-            hunter._victim_stamp = 0
 
         move_at_point = None
-        DRONE_VICTIM_FOCUS_TIME = 4
-        if hunter.victim is not None:
-            # Счетчик повторного поиска жертвы
-            hunter._victim_stamp = min(hunter._victim_stamp + 1, DRONE_VICTIM_FOCUS_TIME)
 
         # Разгрузимся, чтобы не потерять нажитое
         if hunter.is_unloading:
             # Собираем елериум пока не нашли жертву
-            hunter.substrategy.game_step()
+            hunter.substrategy.tick(scene_tick(hunter.scene))
             return
 
-        # Получим ближайшую жертву от другого вызова game_step
-        if hunter._next_victim is not None:
-            if hunter.victim is None:
-                move_at_point = hunter.set_victim(hunter._next_victim)
-
-        # Выберем ближашего свободного союзника
-        victim = None
-        while True:
-            victim = self.get_victim(hunter)
-            if victim is None:
-                break
-            victim_distance = victim.distance_to(hunter)
-            closertm = [mate for mate in hunter.teammates if
-                        mate.victim is None and mate.distance_to(victim) < victim_distance]
-            closertm = [mate for mate in closertm if mate._next_victim is None and not mate.is_unloading]
-            if not closertm:
-                # нет никого свобожного ближе
-                break
-            closertm = sorted(closertm, key=lambda x: x.distance_to(victim))
-            closertm[0]._next_victim = victim
-            victim = None
+        # Жертва из распределения по команде (считается раз в такт)
+        victim = self.get_victim(hunter)
+        if victim is None and hunter.victim is not None:
+            # Жертва досталась другому охотнику (или охотиться не на кого) - возвращаемся к сбору
+            hunter._victim = None
+            self._aims.pop(hunter, None)
         is_new_victim = victim is not None and hunter.victim != victim
 
+        intercept = self._intercepts.get(hunter)
         if is_new_victim:
             move_at_point = hunter.set_victim(victim)
-        elif hunter.victim is not None:
-            if hunter.state.target_point != hunter.victim.coord and hunter._victim_stamp >= DRONE_VICTIM_FOCUS_TIME:
-                # Обновим вектор движения раз в несколько циклов
-                hunter._victim_stamp = 0
-                move_at_point = hunter.victim.coord.copy()
+            if intercept is not None:
+                move_at_point = intercept
+        elif hunter.victim is not None and intercept is not None:
+            aim = self._aims.get(hunter)
+            if aim is None or aim.distance_to(intercept) > self.aim_tolerance:
+                # Прогноз ушел - перенацеливаемся на новую точку перехвата
+                move_at_point = intercept
         if move_at_point is not None and int(hunter.distance_to(move_at_point)) > hunter.radius:
-            hunter.move_at(move_at_point.copy(), speed=theme.DRONE_SPEED)
+            self.aim(hunter, move_at_point)
 
         # Собираем елериум пока не нашли жертву
         if hunter.victim is None and victim is None:
-            hunter.substrategy.game_step()
+            hunter.substrategy.tick(scene_tick(hunter.scene))
 
 
 class StrategyDestroyer(Strategy):
@@ -354,7 +462,7 @@ class StrategyDestroyer(Strategy):
 
     def game_step(self):
         if self.__substrategy is not None:
-            self.__substrategy.game_step()
+            self.tick_child(self.__substrategy, scene_tick(self.unit.scene))
             if not self.__substrategy.is_finished:
                 return
             self.__substrategy = None
@@ -376,42 +484,86 @@ class StrategyDestroyer(Strategy):
 
 
 class DroneUnitWithStrategies(Drone):
+    # Планировщик стратегий: записи [-priority, seq, strategy, alive] упорядочены по приоритету,
+    # замена по группе только помечает вытесненные записи, а выбрасываются они (как и
+    # завершенные стратегии) при следующем проходе game_step
+
+    # True - замерять время game_step по стратегиям (strategy_costs, strategy_report)
+    _strategy_profile = False
 
     def __init__(self, *args, **kwargs):
         super(DroneUnitWithStrategies, self).__init__(**kwargs)
         self.__strategies = []
+        self.__groups = {}
+        self.__seq = 0
+        # Время game_step по стратегиям (id стратегии -> секунды)
+        self.strategy_costs = {}
 
     @property
     def current_strategy(self):
-        return self.__strategies[0] if not self.is_strategy_finished() else None
+        for entry in self.__strategies:
+            if entry[3]:
+                return entry[2]
+        return None
 
     def append_strategy(self, strategy):
+        group = self.__groups.setdefault(strategy.group, [])
         if strategy.is_group_unique:
-            for s in self.__strategies:
-                if s.group == strategy.group:
-                    self.__strategies.remove(s)
-        self.__strategies.append(strategy)
+            for entry in group:
+                entry[3] = False
+            del group[:]
+        self.__seq = self.__seq + 1
+        entry = [-strategy.priority, self.__seq, strategy, True]
+        group.append(entry)
+        bisect.insort(self.__strategies, entry)
 
     def clear_strategies(self):
         self.__strategies = []
+        self.__groups = {}
 
     def is_strategy_finished(self):
-        return len(self.__strategies) == 0
+        return self.current_strategy is None
+
+    def strategy_report(self):
+        total = sum(self.strategy_costs.values())
+        return {sid: {"seconds": seconds, "share": seconds / total if total else 0.0}
+                for sid, seconds in self.strategy_costs.items()}
 
     def game_step(self):
         self.native_game_step()
-        for s in self.__strategies:
-            if s.is_finished:
-                self.__strategies.remove(s)
+        tick = scene_tick(self.scene)
+        dropped = False
+        for entry in self.__strategies:
+            s = entry[2]
+            if entry[3] and s.is_finished:
+                entry[3] = False
+            if not entry[3]:
+                dropped = True
                 continue
+            if s.is_suspended(tick):
+                s.skipped_ticks += 1
+                if s.yields:
+                    continue
+                # Спящий узел держит дрона: дальше по списку не идем
+                break
+            s.ticks += 1
+            if not self._strategy_profile:
+                s.game_step()
+                break
+            started = time.perf_counter()
             s.game_step()
+            sid = s.id if s.id is not None else s.__class__.__name__
+            self.strategy_costs[sid] = self.strategy_costs.get(sid, 0.0) + time.perf_counter() - started
             break
+        if dropped:
+            self.__strategies = [entry for entry in self.__strategies if entry[3]]
+            for group in self.__groups.values():
+                group[:] = [entry for entry in group if entry[3]]
 
     # @brief elerium_stocks возвращает все объекты мира из которых можно добывать ресурсы
     @property
     def elerium_stocks(self):
-        return [es for es in self.scene.get_objects_by_type(Unit) if hasattr(es, 'cargo') and
-                (not es.is_alive if issubclass(es.__class__, tuple([DroneUnitWithStrategies, MotherShip])) else True)]
+        return HarvestableRegistry.for_scene(self.scene).stocks()
 
     # Позволяет обращаться к чистому обработчику из стратегий
     def native_game_step(self):
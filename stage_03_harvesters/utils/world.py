@@ -0,0 +1,68 @@
+import numpy as np
+
+from .distances import coords_of
+
+
+def scene_tick(scene):
+    # Номер игрового такта сцены (robogame_engine хранит его в Scene._step)
+    return getattr(scene, "_step", None)
+
+
+class WorldSnapshot:
+    # Срез мира для команды, собирается один раз за такт и читается всеми состояниями и стратегиями
+    def __init__(self, scene, team, tick=None):
+        self.tick = tick
+        drones = scene.drones
+        self.asteroids = scene.asteroids
+        self.dead_motherships = [m for m in scene.motherships if not m.is_alive and m.team != team]
+        self.dead_drones = [d for d in drones if not d.is_alive]
+        self.enemies = [d for d in drones if d.team != team and d.is_alive]
+        # Порядок как в Dijkstra.update_units: астероиды, мертвые базы, мертвые дроны
+        self.sources = self.asteroids + self.dead_motherships + self.dead_drones
+        self.sources_with_payload = [s for s in self.sources if s.cargo.payload > 0]
+        self.asteroids_with_payload = [a for a in self.asteroids if a.cargo.payload > 0]
+        self._enemy_courses = None
+        self._approached = {}
+
+    @property
+    def has_sources(self):
+        return len(self.sources_with_payload) > 0
+
+    @property
+    def enemy_courses(self):
+        # Координаты и курсы (в градусах, как GameObject.direction) живых врагов
+        if self._enemy_courses is None:
+            xy = coords_of(self.enemies)
+            directions = np.array([d.direction for d in self.enemies], dtype=float)
+            self._enemy_courses = (xy, directions)
+        return self._enemy_courses
+
+    def enemies_approaching(self, targets, distance, angle):
+        # Летит ли к цели хоть один враг ближе distance с курсом в пределах angle.
+        # Все еще не проверенные за этот такт цели считаются одной матрицей (враги x цели)
+        approached = self._approached
+        missing = [t for t in targets if (t, distance, angle) not in approached]
+        if missing:
+            flags = approaching(self.enemy_courses, coords_of(missing), distance, angle)
+            approached.update(((t, distance, angle), f) for t, f in zip(missing, flags.tolist()))
+        return [approached[(t, distance, angle)] for t in targets]
+
+    @classmethod
+    def actual(cls, snapshot, scene, team):
+        tick = scene_tick(scene)
+        if snapshot is None or tick is None or snapshot.tick != tick:
+            snapshot = cls(scene, team, tick)
+        return snapshot
+
+
+def approaching(enemy_courses, targets_xy, distance, angle):
+    xy, directions = enemy_courses
+    if not len(xy):
+        return np.zeros(len(targets_xy), dtype=bool)
+    delta = targets_xy[None, :, :] - xy[:, None, :]
+    # Как Vector.direction: atan2 в градусах по модулю 360, нулевой вектор - 90
+    bearings = np.degrees(np.arctan2(delta[..., 1], delta[..., 0])) % 360
+    bearings[(delta[..., 0] == 0) & (delta[..., 1] == 0)] = 90
+    close = np.hypot(delta[..., 0], delta[..., 1]) < distance
+    aimed = np.fabs(directions[:, None] - bearings) < angle
+    return np.any(close & aimed, axis=0)
@@ -1,7 +1,15 @@
 from unittest import TestCase
 from unittest.mock import patch, Mock
-from kovalev import Role, Harvester
+import numpy as np
+from kovalev import Role, Harvester, TeamSensors
 from astrobox.core import Drone
+from benchmark import differential_check, StandIn, StandInPoint, StandInScene, StandInUnit
+from stage_03_harvesters.utils.assignment import min_cost_assignment
+from stage_03_harvesters.utils.dijkstra import Dijkstra
+from stage_03_harvesters.utils.intercept import intercept_points
+from stage_03_harvesters.utils.registry import HarvestableRegistry
+from stage_03_harvesters.utils.sources import SourceIndex
+from stage_03_harvesters.utils.strategies import Strategy
 
 
 class TestOne(TestCase):
@@ -87,3 +95,212 @@ class TestOne(TestCase):
                                          ['u', 351.294208024572], ['w', 301.294208024572]]
         target = role._get_nearest_point_to_harvest()
         assert target == 'x'
+
+
+class TestPathfindingDifferential(TestCase):
+    def test_engines_match_reference_small_field(self):
+        for seed in range(5):
+            mismatches, skipped = differential_check(10, seed=seed)
+            assert sum(mismatches.values()) == 0, (mismatches, skipped)
+
+    def test_engines_match_reference_medium_field(self):
+        mismatches, skipped = differential_check(100, seed=1)
+        assert sum(mismatches.values()) == 0, (mismatches, skipped)
+
+    def test_path_tree_matches_find_path(self):
+        for seed in range(10):
+            unit = StandInUnit(StandInScene(40, seed))
+            graph = Dijkstra(unit, prune=False)
+            graph.update_units()
+            # Пустые источники недостижимы
+            graph.calc_weights(func=lambda a, b: a.distance_to(b) if b.cargo.payload or b is unit.mothership
+                               else float("inf"))
+            tree = graph.shortest_path_tree(unit.mothership)
+            for point in graph.points:
+                assert tree.path_to(point) == graph.find_path(unit.mothership, point), seed
+
+    def test_path_tree_not_built_with_pruning(self):
+        graph = Dijkstra(StandInUnit(StandInScene(10, 0)))
+        graph.update_units()
+        graph.calc_weights()
+        assert graph.shortest_path_tree(graph.points[0]) is None
+
+    def test_clear_cache(self):
+        graph = Dijkstra(StandInUnit(StandInScene(10, 0)))
+        graph.update_units()
+        graph.calc_weights()
+        graph.find_path(graph.points[0], graph.points[-1])
+        assert graph.cache_info["size"] == 1
+        graph.clear_cache()
+        assert graph.cache_info["size"] == 0
+
+    def test_astar_disabled_with_pruning(self):
+        unit = StandInUnit(StandInScene(10, 0))
+        for prune, enabled in ((True, False), (False, True)):
+            graph = Dijkstra(unit, prune=prune)
+            graph.update_units()
+            graph.calc_weights()
+            assert (graph.heuristic_scale > 0) == enabled, prune
+
+
+class TestSourceIndex(TestCase):
+    def test_nearest_skips_empty_and_excluded_sources(self):
+        sources = [StandIn(x, 0, payload=100) for x in (50, 150, 250, 650, 1150)]
+        index = SourceIndex(sources)
+        unit = StandIn(0, 0)
+        assert index.nearest(unit, 2) == sources[:2]
+        sources[0].cargo.payload = 0
+        assert index.nearest(unit, 2, accept=lambda s: s is not sources[1]) == sources[2:4]
+        assert index.nearest(unit, 1, exclude={sources[1], sources[2]}) == [sources[3]]
+
+    def test_sync_adds_new_sources(self):
+        index = SourceIndex()
+        unit = StandIn(600, 600)
+        assert index.nearest(unit) == []
+        debris = StandIn(1000, 1000, payload=50)
+        index.sync([debris])
+        assert index.nearest(unit, 3) == [debris]
+
+    def test_refilled_source_comes_back(self):
+        near, far = StandIn(100, 0, payload=50), StandIn(900, 0, payload=50)
+        index = SourceIndex([near, far])
+        unit = StandIn(0, 0)
+        near.cargo.payload = 0
+        assert index.nearest(unit) == [far]
+        # Разгрузка на астероид
+        near.cargo.payload = 30
+        index.refresh()
+        assert index.nearest(unit) == [near]
+
+    def test_movable_sources_are_found_after_drift(self):
+        asteroid, debris = StandIn(500, 10, payload=50), StandIn(1000, 1000, payload=50)
+        index = SourceIndex([asteroid], movable=[debris])
+        unit = StandIn(0, 0)
+        debris.coord = StandInPoint(50, 0)
+        assert index.nearest(unit, 2) == [debris, asteroid]
+        assert [source for _, source in index.corridor(StandInPoint(0, 0), StandInPoint(600, 0), 20)] == \
+            [debris, asteroid]
+        index.discard(debris)
+        assert index.nearest(unit, 2) == [asteroid]
+
+    def test_corridor_orders_by_detour(self):
+        near, far, aside = StandIn(500, 40, payload=50), StandIn(300, 90, payload=50), StandIn(600, 400, payload=50)
+        index = SourceIndex([aside, far, near])
+        corridor = index.corridor(StandInPoint(0, 0), StandInPoint(1000, 0), 100)
+        assert [source for _, source in corridor] == [near, far]
+        assert corridor[0][0] < corridor[1][0]
+
+    def test_registry_index_returns_source_refilled_within_tick(self):
+        class StandInRegistry(HarvestableRegistry):
+            KINDS = (("asteroid", StandIn), )
+
+        source = StandIn(50, 0, payload=100)
+        scene = Mock(objects=[source], _step=1)
+        registry = StandInRegistry(scene)
+        registry.refresh()
+        index = registry.index("asteroid")
+        unit = StandIn(0, 0)
+        # Опустел и пополнился между двумя обновлениями реестра: индекс успел его выбросить
+        source.cargo.payload = 0
+        assert index.nearest(unit) == []
+        source.cargo.payload = 100
+        scene._step = 2
+        registry.refresh()
+        assert index.nearest(unit) == [source]
+
+
+class TestStrategySuspend(TestCase):
+    def test_suspend_until_tick(self):
+        strategy = Strategy()
+        strategy.suspend(tick=5)
+        # Без номера такта сцены стратегия не просыпается
+        assert strategy.is_suspended(None)
+        assert strategy.is_suspended(4)
+        assert not strategy.is_suspended(5)
+        assert not strategy.is_suspended(None)
+
+    def test_suspend_until_condition(self):
+        strategy = Strategy()
+        ready = []
+        strategy.suspend(condition=lambda: bool(ready))
+        assert strategy.is_suspended(100)
+        ready.append(True)
+        assert not strategy.is_suspended(None)
+
+
+class TestInterceptPoints(TestCase):
+    def test_stationary_victim(self):
+        points, times = intercept_points(np.array([[0.0, 0.0]]), np.array([[30.0, 40.0]]),
+                                         np.zeros((1, 2)), 5.0)
+        assert np.allclose(points, [[30.0, 40.0]]) and np.allclose(times, [10.0])
+
+    def test_faster_victim_running_away(self):
+        points, times = intercept_points(np.array([[0.0, 0.0]]), np.array([[100.0, 0.0]]),
+                                         np.array([[6.0, 0.0]]), 5.0)
+        # Не догнать: время бесконечно, точка - текущая позиция жертвы
+        assert np.isinf(times[0]) and np.allclose(points, [[100.0, 0.0]])
+
+    def test_faster_victim_coming_closer(self):
+        points, times = intercept_points(np.array([[0.0, 0.0]]), np.array([[110.0, 0.0]]),
+                                         np.array([[-6.0, 0.0]]), 5.0)
+        assert np.allclose(times, [10.0]) and np.allclose(points, [[50.0, 0.0]])
+
+    def test_victim_stops_before_intercept(self):
+        points, times = intercept_points(np.array([[0.0, 0.0]]), np.array([[100.0, 0.0]]),
+                                         np.array([[3.0, 0.0]]), 5.0, stop_times=np.array([10.0]))
+        # Жертва встанет в (130, 0) на 10-м такте, охотник долетит туда за 26
+        assert np.allclose(points, [[130.0, 0.0]]) and np.allclose(times, [26.0])
+
+
+class TestMinCostAssignment(TestCase):
+    def test_global_optimum_beats_greedy(self):
+        # Жадный выбор (0 -> 0) дает 1 + 100, оптимум - 2 + 3
+        assert min_cost_assignment([[1, 2], [3, 100]]) == [(0, 1), (1, 0)]
+
+    def test_rectangular_and_forbidden_pairs(self):
+        inf = float("inf")
+        assert min_cost_assignment([[5, inf, 1]]) == [(0, 2)]
+        assert min_cost_assignment([[inf], [4], [2]]) == [(2, 0)]
+        assert min_cost_assignment([[inf]]) == []
+
+
+class TestTeamSensors(TestCase):
+    def _scene(self):
+        scene = Mock()
+        scene._step = 1
+        home, enemy_base = StandIn(90, 90, team='home'), StandIn(1100, 1100, payload=300, alive=False, team='enemy')
+        scene.motherships = [home, enemy_base]
+        enemies = [StandIn(700, 700, team='enemy'), StandIn(300, 300, team='enemy'), StandIn(500, 100, team='enemy')]
+        wreck = StandIn(150, 150, payload=80, alive=False, team='enemy')
+        drone = StandIn(100, 100, team='home')
+        drone.id, drone.scene, drone.my_mothership, drone.attack_range = 1, scene, home, 200
+        drone.asteroids = [StandIn(x, y, payload=payload) for x, y, payload in
+                           ((400, 400, 100), (120, 200, 50), (900, 100, 0), (180, 110, 30))]
+        for asteroid in drone.asteroids:
+            asteroid.counter = asteroid.cargo.payload
+        scene.drones = [drone, wreck] + enemies
+        return drone, enemies, wreck, enemy_base
+
+    def test_role_lists_match_full_sort(self):
+        drone, enemies, wreck, enemy_base = self._scene()
+        role = Role(drone)
+        role.get_enemies()
+        assert [enemy for enemy, _ in role.enemies] == sorted(enemies, key=drone.distance_to)
+        role.get_overall_points_to_harvest()
+        points = [a for a in drone.asteroids if a.counter > 0] + [wreck, enemy_base]
+        assert [point for point, _ in role.overall_points_with_elerium] == sorted(points, key=drone.distance_to)
+        role.get_overall_points_to_harvest(k=2)
+        assert [point for point, _ in role.overall_points_with_elerium] == sorted(points, key=drone.distance_to)[:2]
+        role.get_safe_points_to_harvest()
+        assert [point for point, _ in role.safe_points_with_elerium] == \
+            sorted([p for p in points if p.distance_to(drone.my_mothership) < 200], key=drone.distance_to)
+        assert role.sensors.nearest_enemy(drone) is enemies[1]
+
+    def test_snapshot_refreshed_once_per_tick(self):
+        drone, enemies, _, _ = self._scene()
+        sensors = TeamSensors.for_drone(drone)
+        enemies[1].is_alive = False
+        assert TeamSensors.for_drone(drone).nearest_enemy(drone) is enemies[1]
+        drone.scene._step += 1
+        assert sensors is TeamSensors.for_drone(drone)
+        assert sensors.nearest_enemy(drone) is enemies[2]